@@ -2,8 +2,14 @@ import os
 from flask import Flask, render_template, request, jsonify, session, send_file, redirect, url_for, Response
 from tutorial_agent import TutorialAgent
 from database import TutorialDatabase
-from rag_engine import RAGEngine
+from rag_engine import READ_ONLY_MESSAGE, get_rag_engine
+from rag_jobs import IngestionQueue
+from rag_documents import store_upload
+from rag_embeddings import warm_up_embeddings, is_embedding_model_ready
+from prompt_packer import pack_prompt
+from rag_summaries import format_summaries, is_summary_request
 import sqlite3
+import threading
 import uuid
 from dotenv import load_dotenv
 
@@ -36,12 +42,41 @@ def transcribe_audio(audio_bytes):
         print(f"Transcription error: {e}")
         return None
 
-# Initialize Agent (Singleton-ish pattern for the app, but user state is separate)
-# Actually TutorialAgent seems stateless regarding user sessions? 
-# Let's check tutorial_agent.py usage. It takes session_id in methods.
-db = TutorialDatabase()
-agent = TutorialAgent()
-rag_engine = RAGEngine()
+# Shared services, created by init_app(). Importing this module must stay
+# free of side effects: PDF parse workers are spawned processes that
+# re-import the main module, and must not load the index or the model.
+db = None
+agent = None
+rag_engine = None
+ingestion_queue = None
+_init_lock = threading.Lock()
+
+
+def init_app():
+    """
+    Create the database, agent, RAG engine and ingestion queue (once).
+    """
+    global db, agent, rag_engine, ingestion_queue
+    with _init_lock:
+        if ingestion_queue is not None:
+            return
+        db = TutorialDatabase()
+        # Initialize Agent (Singleton-ish pattern for the app, but user state is separate)
+        agent = TutorialAgent()
+        rag_engine = get_rag_engine()  # Same instance (and index) the agent uses
+        ingestion_queue = IngestionQueue(rag_engine)
+
+        # Load the embedding model in the background so startup (and endpoints that
+        # never touch RAG) don't wait on torch / sentence-transformers
+        warm_up_embeddings()
+
+
+@app.before_request
+def _ensure_initialized():
+    # Servers that import app (e.g. gunicorn app:app) set up on the first request
+    if ingestion_queue is None:
+        init_app()
+
 
 def detect_topic(user_input: str, tagged_files: list = None) -> str:
     """
@@ -394,29 +429,44 @@ def message_stream():
     if not user_input:
         return jsonify({"error": "Message is required"}), 400
     
-    # Build conversation history
+    conversation_id = session['current_conversation_id']
+    subject = session.get('subject', 'General Topic')
+    
+    # Conversation history, oldest first
     history = db.get_messages(conversation_id, limit=6)
-    history_text = ""
+    turns = []
     for msg in reversed(history):
         role = "Student" if msg['role'] == 'user' else "Socrates"
-        history_text += f"{role}: {msg['content']}\n"
+        turns.append(f"{role}: {msg['content']}")
+    
+    # Overview questions about tagged files are answered from the stored
+    # document summaries, without a retrieval pass
+    summaries = None
+    if tagged_files and is_summary_request(user_input):
+        summaries = rag_engine.get_document_summaries(tagged_files)
     
     # RAG retrieval - use file-specific context if files are tagged
-    context = ""
-    try:
-        if tagged_files and len(tagged_files) > 0:
-            # Use file-specific retrieval
-            context = rag_engine.get_formatted_context_for_files(user_input, tagged_files)
-        else:
-            context = rag_engine.get_formatted_context(user_input)
-    except Exception as e:
-        print(f"RAG Retrieval Error: {e}")
+    chunks = []
+    if summaries is None:
+        try:
+            chunks = rag_engine.get_context_chunks(user_input, tagged_files or None)
+        except Exception as e:
+            print(f"RAG Retrieval Error: {e}")
+    missing_context = rag_engine.missing_files_message(tagged_files) if tagged_files and not chunks and not summaries else ""
     
-    # Build prompt based on context
+    # Build prompt based on context, packed into the prompt token budget:
+    # instructions first, then the latest turns, then the best chunks
     if tagged_files:
         # Files are tagged - focus ONLY on the file content
         file_list = ', '.join(tagged_files)
-        prompt = f"""You are Socrates, an expert AI tutor with access to the student's documents.
+        # This prompt doesn't include the conversation history
+        turns = []
+        def build_prompt(turns, chunks):
+            if summaries:
+                context = format_summaries(summaries)
+            else:
+                context = rag_engine.format_context(chunks, tagged_files) if chunks else missing_context
+            return f"""You are Socrates, an expert AI tutor with access to the student's documents.
 
 IMPORTANT: Write your response in {language}.
 
@@ -437,7 +487,11 @@ Provide a helpful, accurate response based on the file content."""
     
     else:
         # Regular question - provide substantive teaching
-        prompt = f"""You are Socrates, an AI tutor who teaches about {subject}.
+        def build_prompt(turns, chunks):
+            history_text = "\n".join(turns)
+            context = rag_engine.format_context(chunks)
+            context_block = f"NEW CONTEXT FROM DOCUMENTS:\n{context}\n\n" if context else ""
+            return f"""You are Socrates, an AI tutor who teaches about {subject}.
 
 IMPORTANT: Write your response in {language}.
 
@@ -446,17 +500,14 @@ Current learning topic: {subject}
 PREVIOUS CONVERSATION (Use this to avoid repetition and follow the flow):
 {history_text}
 
-NEW CONTEXT FROM DOCUMENTS:
-{context}
-
-The student said: "{user_input}"
+{context_block}The student said: "{user_input}"
 
 TEACHING APPROACH & INTERACTION LOGIC:
 1. **CRITICAL: Explicit Topic Advancement**: If the student affirms your previous suggestion (e.g., "yes", "proceed", "continue"):
    - **DO NOT** repeat the general definition of {subject}. 
    - **DO NOT** give another "introductory overview" or high-level summary.
    - **Immediately** start professional level teaching on the **specific sub-topic** you suggested in the very last message. 
-   - Use the `{context}` to see what you've already taught and move **forward**.
+   - Use the PREVIOUS CONVERSATION to see what you've already taught and move **forward**.
 
 2. **Contextual Quiz Mode**: 
    - Generate 3 questions based *exclusively* on context already taught. 
@@ -475,6 +526,8 @@ RESPONSE FORMAT (150-250 words):
 - Use **bold** for new technical terms.
 - Use bullet points for steps or components.
 - **ONLY** end with a question suggesting the **next** logical concept. """
+    
+    prompt = pack_prompt(build_prompt, turns, chunks)
 
     def generate():
         full_response = ""
@@ -502,6 +555,8 @@ RESPONSE FORMAT (150-250 words):
 @app.route('/api/clear_knowledge_base', methods=['POST'])
 def clear_knowledge_base():
     """Clear all documents from the RAG knowledge base."""
+    if rag_engine.read_only:
+        return jsonify({"error": READ_ONLY_MESSAGE}), 403
     try:
         result = rag_engine.clear_knowledge_base()
         if result:
@@ -543,40 +598,67 @@ def handle_audio():
 
 @app.route('/api/upload_document', methods=['POST'])
 def upload_document():
+    if rag_engine.read_only:
+        return jsonify({"error": READ_ONLY_MESSAGE}), 403
     if 'document' not in request.files:
         return jsonify({"error": "No document part"}), 400
     
-    file = request.files['document']
-    if file.filename == '':
+    # Several files may be sent under the same field; each gets its own job
+    # and their PDF pages are parsed across the shared process pool
+    files = [f for f in request.files.getlist('document') if f.filename != '']
+    if not files:
         return jsonify({"error": "No selected file"}), 400
         
     try:
-        filename = file.filename
-        # Save temp file
-        temp_path = os.path.join("uploaded_images", filename) # Reuse folder or create new? Reuse for now.
-        if not os.path.exists("uploaded_images"):
-            os.makedirs("uploaded_images")
+        jobs = []
+        duplicates = []
+        for file in files:
+            filename = file.filename
+            # Store under the content hash; identical re-uploads map to the same file
+            content_hash, stored_path = store_upload(file, filename)
             
-        file.save(temp_path)
-        
-        # Process with RAG Engine
-        success, result_msg = rag_engine.process_file(temp_path, filename)
-        
-        if not success:
-            return jsonify({"error": result_msg}), 400
-        
-        # Cleanup temp file? Maybe keep for reference? Let's keep for now.
+            existing = rag_engine.find_document_by_hash(content_hash)
+            if existing:
+                duplicates.append({"filename": filename, "existing_filename": existing["filename"]})
+                continue
+            
+            # Parse, embed and index in the background; the client polls the job
+            job = ingestion_queue.submit(stored_path, filename, content_hash=content_hash)
+            jobs.append({"filename": filename, "job_id": job.job_id})
+        
+        if not jobs:
+            # Everything was already ingested; nothing to embed
+            return jsonify({
+                "status": "success",
+                "message": "; ".join(
+                    f"{d['filename']} is already in the knowledge base (as {d['existing_filename']})"
+                    for d in duplicates
+                ) + ". Skipped re-processing.",
+                "filename": duplicates[0]["filename"],
+                "duplicates": duplicates
+            })
         
         return jsonify({
-            "status": "success",
-            "message": result_msg,
-            "filename": filename
-        })
+            "status": "queued",
+            "message": f"Processing {', '.join(job['filename'] for job in jobs)}...",
+            "filename": jobs[0]["filename"],
+            "job_id": jobs[0]["job_id"],
+            "jobs": jobs,
+            "duplicates": duplicates
+        }), 202
         
     except Exception as e:
         print(f"Document Upload Error: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/ingest_jobs/<job_id>', methods=['GET'])
+def get_ingest_job(job_id):
+    """Report the progress of a background document ingestion job."""
+    job = ingestion_queue.status(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown ingestion job"}), 404
+    return jsonify(job)
+
 @app.route('/api/knowledge_base', methods=['GET'])
 def get_knowledge_base():
     """Get information about documents in the knowledge base."""
@@ -589,12 +671,37 @@ def get_knowledge_base():
 @app.route('/api/knowledge_base', methods=['DELETE'])
 def delete_knowledge_base():
     """Clear all documents from the knowledge base."""
+    if rag_engine.read_only:
+        return jsonify({"error": READ_ONLY_MESSAGE}), 403
     try:
         rag_engine.clear_knowledge_base()
         return jsonify({"status": "success", "message": "Knowledge base cleared"})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/knowledge_base/<path:filename>', methods=['DELETE'])
+def delete_knowledge_base_document(filename):
+    """Remove a single document from the knowledge base."""
+    if rag_engine.read_only:
+        return jsonify({"error": READ_ONLY_MESSAGE}), 403
+    try:
+        success, message = rag_engine.delete_document(filename)
+        if not success:
+            return jsonify({"error": message}), 404
+        return jsonify({"status": "success", "message": message})
+    except Exception as e:
+        print(f"Delete Document Error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/rag_status', methods=['GET'])
+def get_rag_status():
+    """Report whether the RAG embedding model has finished warming up, and query cache hit rates."""
+    return jsonify({
+        "embedding_model_ready": is_embedding_model_ready(),
+        "has_index": rag_engine.vector_store is not None,
+        "query_cache": rag_engine.query_cache.stats()
+    })
+
 @app.route('/api/upload_image', methods=['POST'])
 def upload_image():
     if 'image' not in request.files:
@@ -636,5 +743,9 @@ def upload_image():
         return jsonify({"error": str(e)}), 500
 
 if __name__ == '__main__':
+    # The debug reloader's parent process only watches files; the child it
+    # starts (WERKZEUG_RUN_MAIN set) serves requests and does the setup
+    if os.environ.get("WERKZEUG_RUN_MAIN"):
+        init_app()
     # Enabling multithreading for faster concurrent response handling
     app.run(debug=True, port=5001, threaded=True)
@@ -0,0 +1,150 @@
+"""
+Sweep chunk sizes for the RAG index.
+
+Splits a sample corpus at several chunk sizes (in embedder word-pieces, see
+rag_loader._get_splitter) and, for each, reports:
+
+    chunks      number of chunks
+    truncated   share of chunks longer than the embedding model reads
+    index MB    flat float32 index size plus chunk text
+    ingest s    splitting + embedding time
+    p50/p99 ms  single-query search latency
+    recall@k    share of probe queries whose source sentence is in a top-k chunk
+
+Probe queries are sentences sampled from the corpus itself; a query counts
+as found when one of the top-k chunks contains the whole sentence. The
+same queries (and query embeddings) are used for every chunk size.
+--baseline adds the old 1000/200 character splitter for comparison.
+
+Usage:
+    python benchmark_chunk_sizes.py sample_docs/
+    python benchmark_chunk_sizes.py a.pdf notes.md --sizes 128 192 254 --baseline --k 3
+"""
+
+import argparse
+import os
+import re
+import time
+
+import numpy as np
+
+from config import RAG_CHUNK_OVERLAP_TOKENS, RAG_EMBED_BATCH_SIZE
+from rag_documents import DOCUMENTS_DIR
+from rag_embeddings import EMBEDDING_MAX_TOKENS, embedding_model, get_tokenizer
+from rag_loader import CHARS_PER_TOKEN, _get_splitter, iter_chunks, iter_document_pages
+
+SUPPORTED_EXTENSIONS = ('.pdf', '.txt', '.md')
+
+
+def collect_documents(paths):
+    """Expand directories into the documents they contain."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(os.path.join(root, name) for name in sorted(names) if name.lower().endswith(SUPPORTED_EXTENSIONS))
+        elif path.lower().endswith(SUPPORTED_EXTENSIONS):
+            files.append(path)
+    return files
+
+
+def normalize(text: str) -> str:
+    return " ".join(text.split())
+
+
+def sample_queries(files, count, seed=0):
+    """Sentences of 8-40 words sampled from the corpus."""
+    sentences = []
+    for file_path in files:
+        for page in iter_document_pages(file_path):
+            for sentence in re.split(r"(?<=[.!?])\s+", page.page_content):
+                sentence = normalize(sentence)
+                if 8 <= len(sentence.split()) <= 40:
+                    sentences.append(sentence)
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(sentences), size=min(count, len(sentences)), replace=False)
+    return [sentences[i] for i in picks]
+
+
+def token_length(text: str) -> int:
+    """Word-pieces the embedding model sees, including [CLS]/[SEP]."""
+    tokenizer = get_tokenizer()
+    if tokenizer is not None:
+        return len(tokenizer.tokenize(text)) + 2
+    return len(text) // CHARS_PER_TOKEN + 2
+
+
+def embed(texts):
+    vectors = []
+    for start in range(0, len(texts), RAG_EMBED_BATCH_SIZE):
+        vectors.extend(embedding_model.embed_documents(texts[start:start + RAG_EMBED_BATCH_SIZE]))
+    return np.array(vectors, dtype=np.float32)
+
+
+def run(files, splitter, queries, query_vectors, k):
+    """Ingest the corpus with one splitter and measure it."""
+    import faiss
+
+    start = time.perf_counter()
+    texts = [chunk.page_content for file_path in files for chunk in iter_chunks(file_path, splitter=splitter)]
+    vectors = embed(texts)
+    ingest_seconds = time.perf_counter() - start
+
+    index = faiss.IndexFlatL2(vectors.shape[1])
+    index.add(vectors)
+
+    latencies, hits = [], 0
+    normalized = [normalize(text) for text in texts]
+    for query, vector in zip(queries, query_vectors):
+        start = time.perf_counter()
+        _, found = index.search(vector[None, :], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits += any(query in normalized[i] for i in found[0] if i != -1)
+
+    return {
+        "chunks": len(texts),
+        "truncated": sum(token_length(text) > EMBEDDING_MAX_TOKENS for text in texts) / len(texts),
+        "index_mb": (faiss.serialize_index(index).nbytes + sum(len(text.encode()) for text in texts)) / 1e6,
+        "ingest_seconds": ingest_seconds,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "recall": hits / len(queries),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep chunk sizes for the RAG index.")
+    parser.add_argument("paths", nargs="*", default=[DOCUMENTS_DIR], help="Documents or directories (default: uploaded documents)")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[64, 128, 192, 254], help="Chunk sizes in word-pieces")
+    parser.add_argument("--overlap", type=float, help="Overlap as a fraction of the chunk size (default: config ratio)")
+    parser.add_argument("--baseline", action="store_true", help="Also run the old 1000/200 character splitter")
+    parser.add_argument("--k", type=int, default=3, help="k for recall@k")
+    parser.add_argument("--queries", type=int, default=200, help="Probe queries sampled from the corpus")
+    args = parser.parse_args()
+
+    files = collect_documents(args.paths)
+    if not files:
+        parser.error("No PDF, TXT or MD documents found")
+    queries = sample_queries(files, args.queries)
+    if not queries:
+        parser.error("The corpus has no sentences to use as probe queries")
+    query_vectors = np.array([embedding_model.embed_query(query) for query in queries], dtype=np.float32)
+
+    overlap = args.overlap if args.overlap is not None else RAG_CHUNK_OVERLAP_TOKENS / (EMBEDDING_MAX_TOKENS - 2)
+    runs = [(f"{size} tok", _get_splitter(size, int(size * overlap))) for size in args.sizes]
+    if args.baseline:
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+        runs.append(("1000 chr", RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200, length_function=len)))
+
+    print(f"\n{len(files)} documents, {len(queries)} probe queries, recall@{args.k}\n")
+    print(f"{'chunking':<10}{'chunks':>8}{'truncated':>11}{'index MB':>10}{'ingest s':>10}{'p50 ms':>9}{'p99 ms':>9}{'recall':>9}")
+    for label, splitter in runs:
+        result = run(files, splitter, queries, query_vectors, args.k)
+        print(
+            f"{label:<10}{result['chunks']:>8}{result['truncated']:>10.1%} {result['index_mb']:>9.2f}"
+            f"{result['ingest_seconds']:>10.2f}{result['p50_ms']:>9.3f}{result['p99_ms']:>9.3f}{result['recall']:>9.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
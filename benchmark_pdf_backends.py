@@ -0,0 +1,103 @@
+"""
+Benchmark the PDF text-extraction backends in rag_pdf_backends.
+
+For every available backend this reports extraction speed (pages/second) and
+text parity against a reference backend (pypdf by default), measured as the
+word-level overlap of each page's text. Use it to pick the fastest backend
+for our corpus before changing config.PDF_EXTRACTION_BACKEND.
+
+Usage:
+    python benchmark_pdf_backends.py sample_docs/
+    python benchmark_pdf_backends.py a.pdf b.pdf --backends pypdf pymupdf --repeat 3
+"""
+
+import argparse
+import os
+import re
+import time
+from collections import Counter
+
+from rag_pdf_backends import PDF_BACKENDS
+
+
+def collect_pdfs(paths):
+    """Expand directories into the PDF files they contain."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(os.path.join(root, name) for name in sorted(names) if name.lower().endswith('.pdf'))
+        elif path.lower().endswith('.pdf'):
+            files.append(path)
+    return files
+
+
+def extract_all(backend, files):
+    """Extract every page of every file; returns ({file: [page texts]}, seconds)."""
+    texts = {}
+    start = time.perf_counter()
+    for file_path in files:
+        texts[file_path] = list(backend.iter_pages(file_path))
+    return texts, time.perf_counter() - start
+
+
+def word_parity(reference: str, candidate: str) -> float:
+    """Share of words two page texts have in common (1.0 = same words)."""
+    ref_words = Counter(re.findall(r"\w+", reference.lower()))
+    cand_words = Counter(re.findall(r"\w+", candidate.lower()))
+    total = sum(ref_words.values()) + sum(cand_words.values())
+    if total == 0:
+        return 1.0
+    return 2 * sum((ref_words & cand_words).values()) / total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark PDF text-extraction backends.")
+    parser.add_argument("paths", nargs="+", help="PDF files or directories of PDFs")
+    parser.add_argument("--backends", nargs="+", default=list(PDF_BACKENDS), help="Backends to compare")
+    parser.add_argument("--reference", default="pypdf", help="Backend used as the parity reference")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per backend; the fastest run is reported")
+    args = parser.parse_args()
+
+    files = collect_pdfs(args.paths)
+    if not files:
+        parser.error("No PDF files found")
+
+    results = {}
+    for name in args.backends:
+        backend = PDF_BACKENDS[name]()
+        if not backend.is_available():
+            print(f"Skipping {name}: pip install {backend.package}")
+            continue
+        best = None
+        for _ in range(args.repeat):
+            texts, seconds = extract_all(backend, files)
+            best = seconds if best is None else min(best, seconds)
+        results[name] = (texts, best)
+
+    if args.reference not in results:
+        parser.error(f"Reference backend '{args.reference}' is not available")
+    reference_texts = results[args.reference][0]
+    total_pages = sum(len(pages) for pages in reference_texts.values())
+
+    print(f"\n{len(files)} file(s), {total_pages} page(s); parity vs {args.reference}\n")
+    print(f"{'backend':<12}{'seconds':>10}{'pages/s':>10}{'speedup':>9}{'parity':>9}{'worst page':>12}")
+    reference_seconds = results[args.reference][1]
+    for name, (texts, seconds) in results.items():
+        scores = [
+            word_parity(ref_page, page)
+            for file_path in files
+            for ref_page, page in zip(reference_texts[file_path], texts[file_path])
+        ]
+        page_counts_match = all(len(texts[f]) == len(reference_texts[f]) for f in files)
+        mean = sum(scores) / len(scores) if scores else 1.0
+        worst = min(scores) if scores else 1.0
+        print(
+            f"{name:<12}{seconds:>10.3f}{total_pages / max(seconds, 1e-9):>10.1f}"
+            f"{reference_seconds / max(seconds, 1e-9):>8.1f}x{mean:>9.3f}{worst:>12.3f}"
+            + ("" if page_counts_match else "  (page count differs)")
+        )
+
+
+if __name__ == "__main__":
+    main()
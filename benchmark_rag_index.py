@@ -0,0 +1,77 @@
+"""
+Benchmark compressed vector storage for the RAG index.
+
+Builds the index in every storage mode of rag_index_policy (float32, fp16,
+int8 and pq, each with and without exact re-scoring) over the same vectors
+and reports memory per 10k chunks, recall@k against exact search and query
+latency. Use it to pick config.RAG_VECTOR_STORAGE / RAG_EXACT_RESCORE.
+
+Vectors come from the current knowledge base (rag_index/) or, with
+--synthetic N, from N random clustered unit vectors of the embedding size.
+
+Usage:
+    python benchmark_rag_index.py
+    python benchmark_rag_index.py --kind hnsw --k 10
+    python benchmark_rag_index.py --synthetic 50000 --storage float32 int8 pq
+"""
+
+import argparse
+
+import numpy as np
+
+from rag_index_policy import STORAGE_CODES, build_index, evaluate_recall, index_bytes, index_factory_string
+
+
+def load_vectors():
+    """Stored vectors of the current knowledge base (nothing is re-embedded)."""
+    from rag_embeddings import embedding_model
+    from rag_vectorstore import load_vector_store
+
+    vector_store = load_vector_store(embedding_model)
+    if vector_store is None:
+        return None
+    return vector_store.index.reconstruct_n(0, vector_store.index.ntotal)
+
+
+def synthetic_vectors(count, dimension=384, seed=0):
+    """Clustered unit vectors, roughly shaped like sentence embeddings."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(1, count // 50), dimension))
+    vectors = centers[rng.integers(len(centers), size=count)] + 0.5 * rng.normal(size=(count, dimension))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors.astype(np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark compressed storage for the RAG index.")
+    parser.add_argument("--kind", default="flat", choices=["flat", "ivf", "hnsw"], help="Index kind to build")
+    parser.add_argument("--storage", nargs="+", default=list(STORAGE_CODES), help="Storage modes to compare")
+    parser.add_argument("--k", type=int, default=5, help="k for recall@k")
+    parser.add_argument("--queries", type=int, default=200, help="Held-out queries per mode")
+    parser.add_argument("--synthetic", type=int, help="Use this many synthetic vectors instead of rag_index/")
+    args = parser.parse_args()
+
+    vectors = synthetic_vectors(args.synthetic) if args.synthetic else load_vectors()
+    if vectors is None or len(vectors) < 2:
+        parser.error("The knowledge base is empty; upload documents or pass --synthetic N")
+
+    print(f"\n{len(vectors)} vectors of dimension {vectors.shape[1]}, {args.kind} index, recall@{args.k}\n")
+    print(f"{'storage':<10}{'rescore':<9}{'index':<24}{'MB/10k':>9}{'recall':>9}{'p50 ms':>9}{'p99 ms':>9}")
+    for storage in args.storage:
+        for rescore in (False, True):
+            if rescore and storage == "float32":
+                continue
+            index = build_index(vectors, args.kind, storage, rescore)
+            report = evaluate_recall(index, vectors, k=args.k, num_queries=args.queries)
+            megabytes = index_bytes(index) / len(vectors) * 10000 / 1e6
+            latency = report["latency_ms"]
+            print(
+                f"{storage:<10}{'yes' if rescore else 'no':<9}"
+                f"{index_factory_string(args.kind, len(vectors), storage, rescore):<24}"
+                f"{megabytes:>9.2f}{report['recall_at_k']:>9.3f}"
+                f"{latency['approx_p50']:>9.3f}{latency['approx_p99']:>9.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
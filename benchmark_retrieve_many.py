@@ -0,0 +1,84 @@
+"""
+Benchmark batched multi-query retrieval against the sequential loop.
+
+Runs the same queries through RAGEngine.retrieve one at a time and through
+RAGEngine.retrieve_many in batches of several sizes, over the current
+knowledge base (rag_index/), and reports throughput in queries/second.
+The query caches are disabled for every run, so each query is embedded and
+searched.
+
+Queries are read from --queries-file (one per line) or, by default, made
+from the opening words of chunks sampled from the knowledge base.
+
+Usage:
+    python benchmark_retrieve_many.py
+    python benchmark_retrieve_many.py --queries 512 --batch-sizes 8 32 128 --mode hybrid
+    python benchmark_retrieve_many.py --queries-file quiz_questions.txt --k 5
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from rag_cache import QueryCache
+from rag_engine import RAGEngine
+
+
+def sample_queries(engine, count, words=12, seed=0):
+    """The first words of randomly chosen chunks."""
+    vector_store = engine.vector_store
+    rng = np.random.default_rng(seed)
+    positions = rng.choice(vector_store.index.ntotal, size=count, replace=vector_store.index.ntotal < count)
+    queries = []
+    for position in positions:
+        doc = vector_store.docstore.search(vector_store.index_to_docstore_id[int(position)])
+        queries.append(" ".join(doc.page_content.split()[:words]))
+    return queries
+
+
+def timed(engine, run):
+    """Seconds taken by run(), with the query caches disabled."""
+    engine.query_cache = QueryCache(embedding_size=0, result_size=0)
+    start = time.perf_counter()
+    run()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark RAGEngine.retrieve_many against sequential retrieve.")
+    parser.add_argument("--queries", type=int, default=256, help="Queries to sample from the knowledge base")
+    parser.add_argument("--queries-file", help="Read queries from this file instead, one per line")
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[8, 32, 128], help="retrieve_many batch sizes")
+    parser.add_argument("--k", type=int, default=3, help="Chunks retrieved per query")
+    parser.add_argument("--mode", default="dense", choices=["dense", "hybrid"], help="Retrieval mode")
+    args = parser.parse_args()
+
+    engine = RAGEngine()
+    if engine.vector_store is None:
+        parser.error("The knowledge base is empty; upload documents first")
+    if args.queries_file:
+        with open(args.queries_file, 'r', encoding='utf-8') as f:
+            queries = [line.strip() for line in f if line.strip()]
+    else:
+        queries = sample_queries(engine, args.queries)
+
+    # Load and warm the embedding model outside the timed runs
+    engine.retrieve(queries[0], k=args.k, mode=args.mode)
+
+    print(f"\n{len(queries)} queries, k={args.k}, {args.mode} retrieval, {engine.vector_store.index.ntotal} chunks\n")
+    print(f"{'method':<24}{'seconds':>10}{'queries/s':>12}{'speedup':>10}")
+
+    sequential = timed(engine, lambda: [engine.retrieve(query, k=args.k, mode=args.mode) for query in queries])
+    print(f"{'retrieve (sequential)':<24}{sequential:>10.3f}{len(queries) / sequential:>12.1f}{1.0:>9.2f}x")
+    for batch_size in args.batch_sizes:
+        seconds = timed(engine, lambda: [
+            engine.retrieve_many(queries[start:start + batch_size], k=args.k, mode=args.mode)
+            for start in range(0, len(queries), batch_size)
+        ])
+        label = f"retrieve_many ({batch_size})"
+        print(f"{label:<24}{seconds:>10.3f}{len(queries) / seconds:>12.1f}{sequential / seconds:>9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+Offline bulk ingestion: build the knowledge base from a directory.
+
+Seeds rag_index/ with every PDF, TXT and MD file under a directory without
+going through /api/upload_document one file at a time:
+
+    parse   files are read and split on --workers threads (PDF pages go to
+            the shared parse process pool, see rag_loader)
+    embed   chunks from all files are embedded in full batches of
+            --batch-size as they arrive
+    write   one merge into the existing index, rebuilt per the index policy
+            and written as a single new base, with documents_metadata.json,
+            the filename index and routing vectors each replaced once
+
+Files already in the knowledge base (same content hash) are skipped. Each
+parsed file is copied into rag_index/documents/ like an upload and listed
+under its path relative to the directory. Everything is held in memory
+until the final write, so an interrupted run leaves the index untouched.
+Run it while the app is stopped; read-only serving workers pick up the new
+base.
+
+Usage:
+    python bulk_ingest.py course_material/
+    python bulk_ingest.py course_material/ --workers 8 --batch-size 256 --summaries
+"""
+
+import argparse
+import os
+import shutil
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from config import PDF_PARSE_WORKERS, RAG_EMBED_BATCH_SIZE
+from rag_documents import DOCUMENTS_DIR, hash_file, stored_path_for
+
+SUPPORTED_EXTENSIONS = ('.pdf', '.txt', '.md')
+
+
+def collect_files(directory):
+    """(path, name) of every supported file, the name relative to directory."""
+    files = []
+    for root, _, names in os.walk(directory):
+        for name in sorted(names):
+            if name.lower().endswith(SUPPORTED_EXTENSIONS):
+                path = os.path.join(root, name)
+                files.append((path, os.path.relpath(path, directory).replace(os.sep, "/")))
+    return sorted(files, key=lambda item: item[1])
+
+
+def store_copy(path, content_hash, name):
+    """Copy a file into the document store, as store_upload does for uploads."""
+    os.makedirs(DOCUMENTS_DIR, exist_ok=True)
+    stored_path = stored_path_for(content_hash, name)
+    if not os.path.exists(stored_path):
+        tmp_path = os.path.join(DOCUMENTS_DIR, f".upload-{uuid.uuid4().hex}")
+        shutil.copyfile(path, tmp_path)
+        os.replace(tmp_path, stored_path)
+    return stored_path
+
+
+def parse(path, name):
+    """All chunks of one file, labelled with its name."""
+    from rag_loader import iter_chunks
+
+    return list(iter_chunks(path, source=name))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the RAG knowledge base from a directory.")
+    parser.add_argument("directory", help="Directory to ingest (searched recursively)")
+    parser.add_argument("--workers", type=int, default=max(2, PDF_PARSE_WORKERS), help="Files parsed concurrently")
+    parser.add_argument("--batch-size", type=int, default=RAG_EMBED_BATCH_SIZE, help="Chunks per embedding call")
+    parser.add_argument("--summaries", action="store_true", help="Also build the per-document summaries (uses the LLM)")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.directory):
+        parser.error(f"{args.directory} is not a directory")
+    files = collect_files(args.directory)
+    if not files:
+        parser.error("No PDF, TXT or MD files found")
+
+    from rag_embeddings import embedding_model
+    from rag_engine import RAGEngine
+    from rag_vectorstore import add_to_segment
+
+    engine = RAGEngine()
+    if engine.read_only:
+        parser.error("RAG_SERVING_MODE=readonly; run bulk ingestion with a read-write configuration")
+
+    started = time.perf_counter()
+    pending, seen, skipped, duplicates = [], {}, [], []
+    for path, name in files:
+        content_hash = hash_file(path)
+        existing = engine.find_document_by_hash(content_hash)
+        if existing:
+            skipped.append((name, existing["filename"]))
+            continue
+        if content_hash in seen:
+            duplicates.append((name, seen[content_hash]))
+            continue
+        seen[content_hash] = name
+        pending.append({
+            "path": path,
+            "filename": name,
+            "content_hash": content_hash,
+            "bytes": os.path.getsize(path),
+            "positions": [],
+        })
+    for name, existing_name in skipped:
+        print(f"Skipping {name}: already in the knowledge base (as {existing_name})")
+    for name, original_name in duplicates:
+        print(f"Skipping {name}: same content as {original_name} in this run")
+    if not pending:
+        print("Nothing to ingest.")
+        return
+
+    segment, batch, failed = None, [], []
+    embed_seconds = 0.0
+
+    def embed(items):
+        """Embed (chunk, entry) pairs into the segment, recording each file's positions."""
+        nonlocal segment, embed_seconds
+        start = time.perf_counter()
+        vectors = embedding_model.embed_documents([chunk.page_content for chunk, _ in items])
+        embed_seconds += time.perf_counter() - start
+        offset = segment.index.ntotal if segment is not None else 0
+        segment = add_to_segment(segment, [chunk for chunk, _ in items], vectors, [str(uuid.uuid4()) for _ in items], embedding_model)
+        for i, (_, entry) in enumerate(items):
+            entry["positions"].append(offset + i)
+
+    with ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="parse") as pool:
+        futures = {pool.submit(parse, entry["path"], entry["filename"]): entry for entry in pending}
+        for done, future in enumerate(as_completed(futures), 1):
+            entry = futures[future]
+            try:
+                chunks = future.result()
+            except Exception as e:
+                failed.append(entry)
+                print(f"Error processing {entry['filename']}: {e}")
+                continue
+            if not chunks:
+                failed.append(entry)
+                print(f"No text could be extracted from {entry['filename']}.")
+                continue
+            entry["stored_path"] = store_copy(entry["path"], entry["content_hash"], entry["filename"])
+            batch.extend((chunk, entry) for chunk in chunks)
+            while len(batch) >= args.batch_size:
+                embed(batch[:args.batch_size])
+                batch = batch[args.batch_size:]
+            print(f"[{done}/{len(pending)}] {entry['filename']}: {len(chunks)} chunks")
+        if batch:
+            embed(batch)
+    ingested = [entry for entry in pending if entry["positions"]]
+    if segment is None:
+        print("Nothing could be ingested.")
+        return
+    parsed_seconds = time.perf_counter() - started
+
+    write_start = time.perf_counter()
+    result = engine.ingest_bulk(segment, ingested)
+    write_seconds = time.perf_counter() - write_start
+    total_seconds = time.perf_counter() - started
+
+    chunks = result["chunks"]
+    megabytes = sum(entry["bytes"] for entry in ingested) / 1e6
+    print(f"\nIngested {len(ingested)} files ({megabytes:.1f} MB, {chunks} chunks); "
+          f"{len(skipped)} already present, {len(duplicates)} duplicates in this run, {len(failed)} failed")
+    print(f"Index: {result['index_type']}, {result['ntotal']} chunks in total\n")
+    print(f"{'stage':<18}{'seconds':>10}")
+    print(f"{'parse + embed':<18}{parsed_seconds:>10.2f}")
+    print(f"{'  of which embed':<18}{embed_seconds:>10.2f}")
+    print(f"{'write index':<18}{write_seconds:>10.2f}")
+    print(f"{'total':<18}{total_seconds:>10.2f}")
+    print(f"\n{len(ingested) / total_seconds:.2f} files/s, {chunks / total_seconds:.1f} chunks/s, "
+          f"{megabytes / total_seconds:.2f} MB/s ({chunks / max(embed_seconds, 1e-9):.1f} chunks/s embedding)")
+
+    if args.summaries:
+        for entry in ingested:
+            try:
+                built = engine.summarize_document(entry["filename"])
+                print(f"Summary for {entry['filename']}: {'ready' if built else 'skipped'}")
+            except Exception as e:
+                print(f"Summary for {entry['filename']} failed: {e}")
+
+
+if __name__ == "__main__":
+    main()
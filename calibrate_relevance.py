@@ -0,0 +1,55 @@
+"""
+Calibrate the RAG relevance threshold for the current knowledge base.
+
+Scores on-topic probe queries and off-topic conversational turns against
+rag_index/ (see rag_relevance), prints the distributions and writes the
+chosen threshold to rag_index/relevance.json, where RAGEngine picks it up
+without a restart. Re-run after the knowledge base changes substantially.
+
+It then checks that exact-term queries (a rare word taken from a chunk)
+still get context in hybrid mode under the threshold now in effect.
+
+Usage:
+    python calibrate_relevance.py
+    python calibrate_relevance.py --queries 500 --dry-run
+"""
+
+import argparse
+import json
+
+from config import RAG_RECALL_QUERIES
+from rag_relevance import RELEVANCE_FILE, calibrate, exact_term_probes, write_relevance_report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate the RAG relevance threshold.")
+    parser.add_argument("--queries", type=int, default=RAG_RECALL_QUERIES, help="On-topic probe queries")
+    parser.add_argument("--dry-run", action="store_true", help=f"Print the report without writing {RELEVANCE_FILE}")
+    args = parser.parse_args()
+
+    from rag_embeddings import embedding_model
+    from rag_vectorstore import load_vector_store
+
+    vector_store = load_vector_store(embedding_model)
+    if vector_store is None:
+        parser.error("The knowledge base is empty; upload documents first")
+
+    report = calibrate(vector_store, embedding_model, args.queries)
+    print(json.dumps(report, indent=2))
+    if not args.dry_run:
+        write_relevance_report(report)
+        print(f"Wrote {RELEVANCE_FILE}")
+
+    terms = exact_term_probes(vector_store, args.queries)
+    if terms:
+        from rag_engine import RAGEngine
+
+        results = RAGEngine().retrieve_many(terms, mode="hybrid")
+        found = sum(any(term in chunk.lower() for chunk in chunks) for term, chunks in zip(terms, results))
+        print(f"Exact terms found in hybrid mode: {found}/{len(terms)}")
+        if found < len(terms):
+            print("Warning: some exact-term queries got no context; check RAG_RARE_TERM_FRACTION")
+
+
+if __name__ == "__main__":
+    main()
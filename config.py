@@ -2,6 +2,8 @@
 Configuration settings for the AI Tutorial Agent.
 """
 
+import os
+
 # Database Configuration
 DATABASE_PATH = "tutorial_agent.db"
 
@@ -9,6 +11,56 @@ DATABASE_PATH = "tutorial_agent.db"
 LLM_MODEL = "meta-llama/llama-4-scout"
 LLM_TEMPERATURE = 0.7
 MAX_CONTEXT_MESSAGES = 5  # Number of previous messages to include for context
+PROMPT_TOKEN_BUDGET = 4000  # Max prompt tokens for tutoring prompts (instructions, then latest turns, then RAG chunks)
+PROMPT_MIN_PARTIAL_TOKENS = 64  # A turn or chunk that doesn't fit whole is cut only if this many tokens remain
+PROMPT_TOKENIZER = "cl100k_base"  # tiktoken encoding used to count prompt tokens (falls back to ~4 chars/token)
+
+# RAG Configuration
+RAG_COMPACTION_SEGMENTS = 8  # Merge delta segments into the base index once this many accumulate
+# Read-only serving workers (RAG_SERVING_MODE below) only serve the compacted base, so an upload
+# becomes visible to them at the next compaction; set this to 1 on the writer when they are in use
+RAG_EMBED_BATCH_SIZE = 64  # Chunks embedded per model call during ingestion
+RAG_CHUNK_TOKENS = 256  # Chunk size in embedder word-pieces (capped to what the embedding model reads)
+RAG_CHUNK_OVERLAP_TOKENS = 48  # Word-pieces shared by consecutive chunks
+PDF_EXTRACTION_BACKEND = "pypdf"  # "pypdf" (default), "pymupdf" or "pypdfium2"; see rag_pdf_backends.py
+PDF_PARSE_WORKERS = min(4, os.cpu_count() or 1)  # Processes for parallel PDF text extraction (<= 1 disables)
+PDF_PARALLEL_MIN_PAGES = 32  # PDFs this long are split into page ranges across workers
+PDF_PAGES_PER_TASK = 16  # Page range handed to one worker at a time
+INGEST_MAX_WORKERS = 2  # Background threads running document ingestion jobs
+INGEST_JOB_HISTORY = 100  # Finished ingestion jobs kept for status polling
+DOCUMENT_GC_GRACE_SECONDS = 3600  # Unreferenced uploads younger than this are not garbage-collected
+RAG_FLAT_MAX_CHUNKS = 20000  # Above this many chunks the exact flat index is rebuilt as an approximate one
+RAG_INDEX_TYPE = "hnsw"  # Approximate index used above RAG_FLAT_MAX_CHUNKS: "hnsw" or "ivf"
+RAG_HNSW_M = 32  # HNSW graph neighbours per node
+RAG_HNSW_EF_SEARCH = 64  # HNSW search breadth (higher = better recall, slower)
+RAG_IVF_NPROBE = 16  # IVF lists scanned per query (higher = better recall, slower)
+RAG_INDEX_RETRAIN_GROWTH = 4  # Retrain an IVF index once it holds this many times its training size
+RAG_VECTOR_STORAGE = "float32"  # "float32", "fp16", "int8" or "pq" (compressed codes); see rag_index_policy.py
+RAG_PQ_SUBQUANTIZERS = 48  # PQ code bytes per vector (must divide the embedding dimension, 384)
+RAG_EXACT_RESCORE = False  # Re-score compressed-search candidates against full float32 vectors
+RAG_RESCORE_FACTOR = 4  # Candidates re-scored per requested result when RAG_EXACT_RESCORE is on
+RAG_SERVING_MODE = os.getenv("RAG_SERVING_MODE", "readwrite")  # "readonly": memory-map the compacted index, read chunks lazily, reject uploads
+RAG_SERVING_REFRESH_SECONDS = 5  # How often a worker checks rag_index for changes made by other processes
+RAG_CHUNK_CACHE_SIZE = 2048  # Hot chunks kept in memory per process by the SQLite chunk store
+RAG_RETRIEVAL_MODE = "dense"  # Default retrieval: "dense" (FAISS only) or "hybrid" (FAISS + BM25, fused by rank)
+RAG_RRF_K = 60  # Reciprocal rank fusion constant (higher = flatter weighting of top ranks)
+RAG_FETCH_FACTOR = 4  # Candidates fetched per requested chunk (from each ranking in hybrid mode) before MMR selection
+RAG_MMR_LAMBDA = 0.7  # MMR trade-off between relevance (1.0) and diversity among the selected chunks
+RAG_DUPLICATE_SIMILARITY = 0.95  # Candidates at least this similar (cosine) to a selected chunk are skipped
+RAG_MIN_OVERLAP_CHARS = 20  # Shortest text span repeated between selected chunks that gets trimmed
+RAG_QUERY_EMBEDDING_CACHE_SIZE = 1024  # Query embeddings kept by RAGEngine (LRU, kept across index versions)
+RAG_RESULT_CACHE_SIZE = 512  # Retrieval results kept by RAGEngine (LRU, keyed by index version)
+RAG_MIN_RELEVANCE = 0.3  # Cosine similarity a chunk needs to enter the prompt until calibrate_relevance.py has run
+RAG_RELEVANCE_DROP = 0.15  # Adaptive k: chunks scoring more than this below the best chunk are left out
+RAG_RARE_TERM_FRACTION = 0.01  # Hybrid mode: BM25 hits on a query term in at most this share of chunks (an identifier, a formula name) skip the threshold
+RAG_ROUTING_MIN_FILES = 20  # Route untagged queries to their best-matching files once the knowledge base has this many
+RAG_ROUTING_FAN_OUT = 5  # Files whose chunks are searched per routed query
+RAG_ROUTING_VECTORS = 4  # Representative vectors (k-means centroids) kept per file for routing
+RAG_BUILD_SUMMARIES = False  # Summarize each uploaded document in the background after ingestion (one LLM call per group of chunks and per level, on every upload)
+RAG_SUMMARY_GROUP_TOKENS = 3000  # Text summarized per LLM call when building the hierarchical summaries
+RAG_SUMMARY_MAX_TOKENS = 300  # Length cap of each generated summary (chunk group, section and file)
+RAG_RECALL_QUERIES = 200  # Held-out queries used to measure recall after a rebuild
+RAG_RECALL_K = 5  # k for the recall@k report
 
 # Tutorial Generation Settings
 TUTORIAL_LENGTH_TARGET = "300-500 words"
@@ -0,0 +1,109 @@
+"""
+Token-budgeted prompt assembly.
+
+Tutoring prompts combine three kinds of text: fixed instructions, recent
+conversation turns and RAG chunks. pack_prompt fills config.PROMPT_TOKEN_BUDGET
+in that order of priority:
+
+1. instructions (the prompt template itself) are always sent
+2. conversation turns, newest first, until the budget is used
+3. RAG chunks in ranking order (best first) with what is left
+
+An item that no longer fits whole is cut (keeping its beginning) when at
+least PROMPT_MIN_PARTIAL_TOKENS remain, otherwise it is left out.
+
+Tokens are counted with tiktoken (config.PROMPT_TOKENIZER, close to the
+Llama 3 tokenizer) when it is installed, else estimated as ~4 characters
+per token.
+"""
+
+import threading
+
+from config import PROMPT_MIN_PARTIAL_TOKENS, PROMPT_TOKEN_BUDGET, PROMPT_TOKENIZER
+
+CHARS_PER_TOKEN = 4
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    """The tiktoken encoding, or False if tiktoken isn't available."""
+    global _encoding
+    if _encoding is None:
+        with _encoding_lock:
+            if _encoding is None:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding(PROMPT_TOKENIZER)
+                except Exception as e:
+                    print(f"tiktoken unavailable ({e}); estimating prompt tokens from length")
+                    _encoding = False
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """The beginning of text, at most max_tokens long."""
+    if max_tokens <= 0:
+        return ""
+    encoding = _get_encoding()
+    if encoding:
+        tokens = encoding.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+    return text[:max_tokens * CHARS_PER_TOKEN]
+
+
+def _fit(items: list, remaining: int) -> tuple[list, int]:
+    """Take items in order while they fit; the first that doesn't may be cut."""
+    taken = []
+    for item in items:
+        # +1 for the separator between items
+        cost = count_tokens(item) + 1
+        if cost <= remaining:
+            taken.append(item)
+            remaining -= cost
+            continue
+        if remaining >= PROMPT_MIN_PARTIAL_TOKENS:
+            # Leave room for the separator and the "..." marker
+            taken.append(truncate_tokens(item, remaining - 2) + "...")
+            remaining = 0
+        break
+    return taken, remaining
+
+
+def pack_prompt(build, turns: list = (), chunks: list = (), budget: int = PROMPT_TOKEN_BUDGET) -> str:
+    """
+    Build a prompt that fits the token budget.
+
+    Args:
+        build: build(turns, chunks) -> prompt text; must render an empty
+            list without its section (e.g. no context header for no chunks)
+        turns: conversation turns, oldest first
+        chunks: RAG chunks, best first
+        budget: maximum prompt tokens
+    """
+    remaining = budget - count_tokens(build([], []))
+    if remaining < 0:
+        print(f"Prompt instructions alone exceed the token budget ({budget - remaining} > {budget})")
+
+    kept_turns, remaining = _fit(list(reversed(turns)), remaining)
+    kept_turns.reverse()
+    kept_chunks, remaining = _fit(list(chunks), remaining)
+
+    # Section headers and separators were only estimated above; drop the
+    # lowest-priority items until the rendered prompt really fits
+    prompt = build(kept_turns, kept_chunks)
+    while count_tokens(prompt) > budget and (kept_chunks or kept_turns):
+        if kept_chunks:
+            kept_chunks.pop()
+        else:
+            kept_turns.pop(0)
+        prompt = build(kept_turns, kept_chunks)
+    return prompt
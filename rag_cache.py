@@ -0,0 +1,160 @@
+"""
+Query caches for RAGEngine.
+
+Quick actions and follow-up prompts send the same queries over and over, so
+RAGEngine keeps two bounded LRU caches:
+
+    embeddings  normalized query -> query embedding
+    results     (normalized query, index version, k, mode, ...) -> chunks
+
+Query embeddings don't depend on the index, so they are kept across
+versions. Results are keyed by the index version they were computed
+against, so requests still running on an older snapshot keep their own
+entries while new requests fill the cache for the new version. Once a newer
+version shows up, entries older than the version it replaced are dropped
+(an in-flight request on the previous version still hits); anything else
+ages out of the LRU. Hit and miss counters cover the whole process.
+"""
+
+import threading
+from collections import OrderedDict
+
+from config import RAG_QUERY_EMBEDDING_CACHE_SIZE, RAG_RESULT_CACHE_SIZE
+
+
+def normalize_query(query: str) -> str:
+    """
+    Cache key for a query. Case and whitespace are dropped; the embedding
+    model (all-MiniLM-L6-v2) is uncased and BM25 search lowercases too.
+    """
+    return " ".join(query.split()).lower()
+
+
+class LRUCache:
+    """Thread-safe bounded mapping that evicts the least recently used entry."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """The cached value, or None on a miss."""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def prune(self, keep):
+        """Drop every entry whose key fails keep(key)."""
+        with self._lock:
+            for key in [key for key in self._entries if not keep(key)]:
+                del self._entries[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+class QueryCache:
+    """Query embedding cache plus retrieval results keyed by index version."""
+
+    def __init__(self, embedding_size: int = RAG_QUERY_EMBEDDING_CACHE_SIZE, result_size: int = RAG_RESULT_CACHE_SIZE):
+        self.embeddings = LRUCache(embedding_size)
+        self.results = LRUCache(result_size)
+        self.version = None
+        self.invalidations = 0
+        self._lock = threading.Lock()
+
+    def _check_version(self, version: int):
+        """Note the newest version seen; results two versions behind it are dropped."""
+        with self._lock:
+            if self.version is not None and version <= self.version:
+                return
+            previous, self.version = self.version, version
+            if previous is None:
+                return
+            self.invalidations += 1
+        self.results.prune(lambda key: key[1] >= previous)
+
+    def embedding(self, query: str, embed):
+        """Embedding of query, computed with embed(query) on a miss."""
+        key = normalize_query(query)
+        vector = self.embeddings.get(key)
+        if vector is None:
+            vector = embed(query)
+            self.embeddings.put(key, vector)
+        return vector
+
+    def embeddings_many(self, queries: list, embed_many) -> list:
+        """
+        Embeddings of several queries; the misses are computed together with
+        one embed_many(texts) call.
+        """
+        keys = [normalize_query(query) for query in queries]
+        vectors = [self.embeddings.get(key) for key in keys]
+        missing = {}
+        for query, key, vector in zip(queries, keys, vectors):
+            if vector is None:
+                missing.setdefault(key, query)
+        if missing:
+            computed = dict(zip(missing, embed_many(list(missing.values()))))
+            for key, vector in computed.items():
+                self.embeddings.put(key, vector)
+            vectors = [vector if vector is not None else computed[key] for key, vector in zip(keys, vectors)]
+        return vectors
+
+    def documents(self, query: str, version: int, compute, *key):
+        """
+        Retrieved Documents for query, computed with compute() on a miss.
+        key holds whatever else the result depends on (k, mode, files).
+        """
+        docs = self.cached_documents(query, version, *key)
+        if docs is None:
+            docs = compute()
+            self.store_documents(query, version, docs, *key)
+        return list(docs)
+
+    def cached_documents(self, query: str, version: int, *key):
+        """The cached Documents for query, or None."""
+        self._check_version(version)
+        docs = self.results.get(self._result_key(query, version, key))
+        return None if docs is None else list(docs)
+
+    def store_documents(self, query: str, version: int, docs: list, *key):
+        self.results.put(self._result_key(query, version, key), docs)
+
+    def _result_key(self, query: str, version: int, key: tuple) -> tuple:
+        # The version is part of the key, so a result computed against an
+        # older index can never be served after a newer one is published
+        return (normalize_query(query), version) + key
+
+    def stats(self) -> dict:
+        return {
+            "index_version": self.version,
+            "invalidations": self.invalidations,
+            "embeddings": self.embeddings.stats(),
+            "results": self.results.stats(),
+        }
@@ -0,0 +1,359 @@
+"""
+SQLite chunk store: the docstore of the RAG index.
+
+Chunk text and metadata live in rag_index/chunks.db instead of a pickled
+InMemoryDocstore, so they are read from disk on demand (with a small LRU
+cache of hot chunks) rather than held in every process's memory.
+
+    chunks     doc_id -> source, page_content, metadata
+    chunks_fts FTS5 inverted index over the chunk text (BM25 search),
+               kept in sync with chunks by triggers
+    positions  (index dir, FAISS position) -> doc_id, one set of rows per
+               base / segment directory; this replaces index.pkl
+
+Doc ids never change, so chunk rows are shared by every index version.
+Positions are written per directory when it is saved, which keeps them
+consistent with the index.faiss they describe.
+"""
+
+import json
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+
+from langchain_community.docstore.base import Docstore
+from langchain_core.documents import Document
+
+from config import RAG_CHUNK_CACHE_SIZE
+
+CHUNK_STORE_PATH = os.path.join("rag_index", "chunks.db")
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def _file_id(path: str):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_dev, stat.st_ino
+
+
+def get_chunk_store(read_only: bool = False) -> "ChunkStore":
+    """
+    Shared ChunkStore for rag_index/chunks.db. A new one is opened if the
+    file was removed or replaced (e.g. the knowledge base was cleared, here
+    or by another process).
+    """
+    with _stores_lock:
+        store = _stores.get(read_only)
+        if store is None or store.file_id is None or store.file_id != _file_id(CHUNK_STORE_PATH):
+            store = ChunkStore(CHUNK_STORE_PATH, read_only=read_only)
+            _stores[read_only] = store
+        return store
+
+
+class ChunkStore:
+    """
+    Chunks and FAISS positions in SQLite. sqlite3 connections can't be
+    shared between threads, so each thread opens its own.
+    """
+
+    def __init__(self, path: str, read_only: bool = False, cache_size: int = RAG_CHUNK_CACHE_SIZE):
+        self.path = path
+        self.read_only = read_only
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._local = threading.local()
+        if not read_only:
+            self._create_schema()
+        self.file_id = _file_id(path)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if self.read_only:
+                conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+            else:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                conn = sqlite3.connect(self.path)
+                # INSERT OR REPLACE must fire the delete trigger that updates chunks_fts
+                conn.execute("PRAGMA recursive_triggers = ON")
+            self._local.conn = conn
+        return conn
+
+    def _create_schema(self):
+        conn = self._connection()
+        # WAL lets read-only serving workers read while the writer commits
+        conn.execute("PRAGMA journal_mode=WAL")
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS chunks ("
+                "doc_id TEXT PRIMARY KEY, source TEXT NOT NULL, content TEXT NOT NULL, metadata TEXT NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_source ON chunks (source)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS positions ("
+                "store TEXT NOT NULL, position INTEGER NOT NULL, doc_id TEXT NOT NULL, "
+                "PRIMARY KEY (store, position))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_positions_doc_id ON positions (doc_id)")
+            self._create_text_index(conn)
+            # Per-term document counts of the text index (see rare_terms)
+            conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS chunks_vocab USING fts5vocab(chunks_fts, 'row')")
+
+    def _create_text_index(self, conn):
+        """
+        FTS5 index over chunks.content. '_' counts as a word character so
+        code identifiers like train_test_split stay one token.
+        """
+        exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'chunks_fts'").fetchone()
+        if exists:
+            return
+        conn.execute(
+            "CREATE VIRTUAL TABLE chunks_fts USING fts5("
+            "content, content='chunks', content_rowid='rowid', tokenize=\"unicode61 tokenchars '_'\")"
+        )
+        conn.execute(
+            "CREATE TRIGGER IF NOT EXISTS chunks_fts_insert AFTER INSERT ON chunks BEGIN "
+            "INSERT INTO chunks_fts(rowid, content) VALUES (new.rowid, new.content); END"
+        )
+        conn.execute(
+            "CREATE TRIGGER IF NOT EXISTS chunks_fts_delete AFTER DELETE ON chunks BEGIN "
+            "INSERT INTO chunks_fts(chunks_fts, rowid, content) VALUES ('delete', old.rowid, old.content); END"
+        )
+        # Chunk stores created before the text index existed
+        conn.execute("INSERT INTO chunks_fts(chunks_fts) VALUES ('rebuild')")
+
+    # Chunks
+
+    def add(self, documents: dict, legacy: bool = False):
+        """
+        Insert chunks given as {doc_id: Document}. The source column is the
+        name the document is listed and tagged under (metadata["source"]).
+        legacy: chunks migrated from a pickled index, whose source is the
+        saved upload's path; only its file name is kept.
+        """
+        rows = [
+            (
+                doc_id,
+                os.path.basename(doc.metadata.get('source', '')) if legacy else doc.metadata.get('source', ''),
+                doc.page_content,
+                json.dumps(doc.metadata),
+            )
+            for doc_id, doc in documents.items()
+        ]
+        with self._connection() as conn:
+            conn.executemany("INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?)", rows)
+
+    def get(self, doc_id: str):
+        """The chunk's Document, or None. Recently read chunks come from the LRU cache."""
+        with self._cache_lock:
+            doc = self._cache.get(doc_id)
+            if doc is not None:
+                self._cache.move_to_end(doc_id)
+                return doc
+        row = self._connection().execute(
+            "SELECT content, metadata FROM chunks WHERE doc_id = ?", (doc_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        doc = Document(id=doc_id, page_content=row[0], metadata=json.loads(row[1]))
+        with self._cache_lock:
+            self._cache[doc_id] = doc
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return doc
+
+    def delete(self, doc_ids):
+        doc_ids = list(doc_ids)
+        with self._connection() as conn:
+            conn.executemany("DELETE FROM chunks WHERE doc_id = ?", [(doc_id,) for doc_id in doc_ids])
+        with self._cache_lock:
+            for doc_id in doc_ids:
+                self._cache.pop(doc_id, None)
+
+    def search_text(self, query: str, limit: int, sources: list = None) -> list:
+        """
+        BM25 search over chunk text. Returns doc ids, best match first.
+        Only chunks that belong to an index directory are returned, so rows
+        of deleted or half-ingested documents never surface.
+        """
+        terms = re.findall(r"\w+", query.lower())
+        if not terms:
+            return []
+        # Quote every term so FTS5 operators and punctuation in the query are inert
+        match = " OR ".join(f'"{term}"' for term in dict.fromkeys(terms))
+        sql = (
+            "SELECT c.doc_id FROM chunks_fts JOIN chunks c ON c.rowid = chunks_fts.rowid "
+            "WHERE chunks_fts MATCH ? AND EXISTS (SELECT 1 FROM positions p WHERE p.doc_id = c.doc_id)"
+        )
+        params = [match]
+        if sources is not None:
+            sql += f" AND c.source IN ({', '.join('?' for _ in sources)})"
+            params.extend(sources)
+        sql += " ORDER BY bm25(chunks_fts) LIMIT ?"
+        params.append(limit)
+        return [row[0] for row in self._connection().execute(sql, params)]
+
+    def rare_terms(self, query: str, max_chunks: int) -> list:
+        """
+        The query's terms that occur in at most max_chunks chunks: the
+        identifiers and names a query is looking for, not its common words.
+        """
+        terms = list(dict.fromkeys(re.findall(r"\w+", query.lower())))
+        if not terms:
+            return []
+        try:
+            rows = self._connection().execute(
+                f"SELECT term, doc FROM chunks_vocab WHERE term IN ({', '.join('?' for _ in terms)})", terms
+            ).fetchall()
+        except sqlite3.OperationalError:
+            # Read-only worker on a chunk store the writer hasn't upgraded yet
+            return []
+        return [term for term, count in rows if count <= max_chunks]
+
+    def count(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    # Positions
+
+    def write_positions(self, store: str, doc_ids: list):
+        """Record the position -> doc id map of an index directory (position = list index)."""
+        with self._connection() as conn:
+            conn.execute("DELETE FROM positions WHERE store = ?", (store,))
+            conn.executemany(
+                "INSERT INTO positions VALUES (?, ?, ?)",
+                [(store, position, doc_id) for position, doc_id in enumerate(doc_ids)]
+            )
+
+    def has_positions(self, store: str) -> bool:
+        if self.read_only and not os.path.exists(self.path):
+            return False
+        row = self._connection().execute("SELECT 1 FROM positions WHERE store = ? LIMIT 1", (store,)).fetchone()
+        return row is not None
+
+    def read_positions(self, store: str) -> dict:
+        rows = self._connection().execute("SELECT position, doc_id FROM positions WHERE store = ?", (store,))
+        return dict(rows)
+
+    def drop_positions(self, keep):
+        """Forget the positions of every index directory not in keep."""
+        keep = list(keep)
+        placeholders = ", ".join("?" for _ in keep)
+        with self._connection() as conn:
+            conn.execute(f"DELETE FROM positions WHERE store NOT IN ({placeholders})", keep)
+
+    def doc_id(self, store: str, position: int):
+        row = self._connection().execute(
+            "SELECT doc_id FROM positions WHERE store = ? AND position = ?", (store, position)
+        ).fetchone()
+        return row[0] if row else None
+
+    def positions_of(self, store: str, doc_ids: list) -> dict:
+        """doc id -> position in one index directory, for the given ids that have one."""
+        doc_ids = list(doc_ids)
+        if not doc_ids:
+            return {}
+        rows = self._connection().execute(
+            f"SELECT doc_id, position FROM positions WHERE store = ? AND doc_id IN ({', '.join('?' for _ in doc_ids)})",
+            [store] + doc_ids
+        )
+        return dict(rows)
+
+    def position_count(self, store: str) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM positions WHERE store = ?", (store,)).fetchone()[0]
+
+    def chunk_sources(self) -> dict:
+        """doc id -> source of every stored chunk."""
+        return dict(self._connection().execute("SELECT doc_id, source FROM chunks"))
+
+    def sources(self, store: str) -> list:
+        """Sources with at least one chunk in the given index directory."""
+        rows = self._connection().execute(
+            "SELECT DISTINCT c.source FROM chunks c JOIN positions p ON p.doc_id = c.doc_id WHERE p.store = ?",
+            (store,)
+        )
+        return [row[0] for row in rows]
+
+    def positions_for_source(self, store: str, source: str) -> list:
+        rows = self._connection().execute(
+            "SELECT p.position FROM chunks c JOIN positions p ON p.doc_id = c.doc_id "
+            "WHERE c.source = ? AND p.store = ? ORDER BY p.position",
+            (source, store)
+        )
+        return [row[0] for row in rows]
+
+
+class ChunkStoreDocstore(Docstore):
+    """LangChain docstore over a ChunkStore."""
+
+    def __init__(self, store: ChunkStore):
+        self.store = store
+
+    def search(self, search: str):
+        doc = self.store.get(search)
+        if doc is None:
+            return f"ID {search} not found."
+        return doc
+
+    def add(self, texts: dict):
+        self.store.add(texts)
+
+    def delete(self, ids):
+        self.store.delete(ids)
+
+
+class ChunkIdMap(Mapping):
+    """
+    FAISS position -> doc id of one index directory, read on demand.
+    Used by read-only serving workers instead of loading every id.
+    """
+
+    def __init__(self, store: ChunkStore, name: str):
+        self.store = store
+        self.name = name
+        self._count = None
+
+    def __getitem__(self, position):
+        doc_id = self.store.doc_id(self.name, int(position))
+        if doc_id is None:
+            raise KeyError(position)
+        return doc_id
+
+    def __iter__(self):
+        return iter(range(len(self)))
+
+    def positions_of(self, doc_ids: list) -> dict:
+        """Reverse lookup: doc id -> position."""
+        return self.store.positions_of(self.name, doc_ids)
+
+    def __len__(self):
+        if self._count is None:
+            self._count = self.store.position_count(self.name)
+        return self._count
+
+
+class SourcePositions(Mapping):
+    """Filename -> FAISS positions of its chunks in one index directory, read on demand."""
+
+    def __init__(self, store: ChunkStore, name: str):
+        self.store = store
+        self.name = name
+
+    def __getitem__(self, source):
+        positions = self.store.positions_for_source(self.name, source)
+        if not positions:
+            raise KeyError(source)
+        return positions
+
+    def __iter__(self):
+        return iter(self.store.sources(self.name))
+
+    def __len__(self):
+        return len(self.store.sources(self.name))
@@ -0,0 +1,108 @@
+"""
+Context assembly for RAG prompts.
+
+Retrieval gathers more candidate chunks than the prompt needs; this stage
+decides which of them go into the prompt and how much of each:
+
+1. Maximal marginal relevance (MMR) over the candidates' stored vectors.
+   Each pick maximizes
+
+       RAG_MMR_LAMBDA * relevance - (1 - RAG_MMR_LAMBDA) * similarity to earlier picks
+
+   so a chunk that repeats one already picked (a near-duplicate from a
+   re-uploaded document, or its overlapping neighbour) gives way to one that
+   adds new information. Candidates at least RAG_DUPLICATE_SIMILARITY similar
+   to a pick are never picked.
+2. Overlap trimming. Neighbouring chunks of a document share up to
+   chunk_overlap tokens (see rag_loader); text a chunk repeats from an
+   earlier pick is cut, and chunks contained in an earlier pick are dropped.
+"""
+
+import numpy as np
+from langchain_core.documents import Document
+
+from config import RAG_DUPLICATE_SIMILARITY, RAG_MIN_OVERLAP_CHARS, RAG_MMR_LAMBDA
+
+
+def normalize_rows(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def mmr_select(relevance, vectors, k: int, lambda_mult: float = RAG_MMR_LAMBDA,
+               duplicate_similarity: float = RAG_DUPLICATE_SIMILARITY) -> list:
+    """
+    Indexes of up to k candidates chosen by maximal marginal relevance, in
+    pick order. relevance holds one score per candidate (higher is better,
+    on a 0-1 scale); vectors are the candidates' embeddings.
+    """
+    relevance = np.asarray(relevance, dtype=np.float32)
+    if len(relevance) == 0:
+        return []
+    vectors = normalize_rows(vectors)
+    similarity = vectors @ vectors.T
+    redundancy = np.full(len(relevance), -np.inf, dtype=np.float32)
+    available = np.ones(len(relevance), dtype=bool)
+
+    selected = []
+    while len(selected) < k and available.any():
+        if selected:
+            scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        else:
+            scores = relevance.copy()
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        redundancy = np.maximum(redundancy, similarity[best])
+        available &= redundancy < duplicate_similarity
+    return selected
+
+
+def overlap_length(first: str, second: str, min_overlap: int = RAG_MIN_OVERLAP_CHARS) -> int:
+    """Length of the longest suffix of first that is also a prefix of second (0 if shorter than min_overlap)."""
+    if len(first) < min_overlap or len(second) < min_overlap:
+        return 0
+    probe = second[:min_overlap]
+    start = first.find(probe, max(0, len(first) - len(second)))
+    while start != -1:
+        if second.startswith(first[start:]):
+            return len(first) - start
+        start = first.find(probe, start + 1)
+    return 0
+
+
+def trim_overlaps(docs: list, min_overlap: int = RAG_MIN_OVERLAP_CHARS) -> list:
+    """
+    Documents with text repeated from earlier documents in the list cut
+    away; documents with nothing new left are dropped. Returns new Document
+    objects, the inputs (shared with the chunk cache) are left untouched.
+    """
+    kept = []
+    results = []
+    for doc in docs:
+        text = doc.page_content
+        for earlier in kept:
+            if text in earlier:
+                text = ""
+                break
+            # earlier ... | overlap | ... text
+            text = text[overlap_length(earlier, text, min_overlap):]
+            # text ... | overlap | ... earlier
+            text = text[:len(text) - overlap_length(text, earlier, min_overlap)]
+        text = text.strip()
+        if not text:
+            continue
+        kept.append(doc.page_content)
+        results.append(Document(id=doc.id, page_content=text, metadata=doc.metadata))
+    return results
+
+
+def assemble_context(docs: list, relevance, vectors, k: int) -> list:
+    """
+    Pick k of the candidate documents with MMR, then trim the text they
+    repeat from one another. Returns Documents in pick order.
+    """
+    picks = mmr_select(relevance, vectors, k)
+    return trim_overlaps([docs[i] for i in picks])
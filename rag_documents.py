@@ -0,0 +1,83 @@
+"""
+Content-addressed storage for uploaded knowledge-base documents.
+
+Uploads are stored once under rag_index/documents/<sha256><ext>, so the same
+PDF uploaded twice maps to the same file and the same metadata record, and
+RAGEngine can skip re-embedding it. Files no metadata record points to are
+removed by collect_garbage.
+"""
+
+import hashlib
+import os
+import time
+import uuid
+
+from config import DOCUMENT_GC_GRACE_SECONDS
+from rag_vectorstore import INDEX_PATH
+
+DOCUMENTS_DIR = os.path.join(INDEX_PATH, "documents")
+_BLOCK_SIZE = 1024 * 1024
+
+
+def hash_file(file_path: str) -> str:
+    """SHA-256 of a file's contents."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def stored_path_for(content_hash: str, filename: str) -> str:
+    """Where a document with this content is kept (extension drives the loader)."""
+    extension = os.path.splitext(filename)[1].lower()
+    return os.path.join(DOCUMENTS_DIR, f"{content_hash}{extension}")
+
+
+def store_upload(file_storage, filename: str) -> tuple[str, str]:
+    """
+    Save an uploaded file (Werkzeug FileStorage) under its content hash.
+    The upload is hashed while it is streamed to disk. Returns (content_hash, path).
+    """
+    os.makedirs(DOCUMENTS_DIR, exist_ok=True)
+    tmp_path = os.path.join(DOCUMENTS_DIR, f".upload-{uuid.uuid4().hex}")
+    digest = hashlib.sha256()
+    try:
+        with open(tmp_path, 'wb') as out:
+            for block in iter(lambda: file_storage.stream.read(_BLOCK_SIZE), b''):
+                digest.update(block)
+                out.write(block)
+        content_hash = digest.hexdigest()
+        path = stored_path_for(content_hash, filename)
+        # Same hash means same bytes, so replacing an existing copy is harmless
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return content_hash, path
+
+
+def collect_garbage(referenced_hashes, grace_seconds: int = DOCUMENT_GC_GRACE_SECONDS) -> list:
+    """
+    Delete stored documents (and abandoned partial uploads) that no
+    metadata record references. Files younger than grace_seconds are kept,
+    since their ingestion job may still be queued (possibly in another worker).
+    Returns the removed file names.
+    """
+    if not os.path.exists(DOCUMENTS_DIR):
+        return []
+    referenced = set(referenced_hashes)
+    cutoff = time.time() - grace_seconds
+    removed = []
+    for name in os.listdir(DOCUMENTS_DIR):
+        if os.path.splitext(name)[0] in referenced:
+            continue
+        path = os.path.join(DOCUMENTS_DIR, name)
+        try:
+            if os.path.getmtime(path) > cutoff:
+                continue
+            os.remove(path)
+            removed.append(name)
+        except OSError:
+            pass
+    return removed
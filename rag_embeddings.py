@@ -1,7 +1,97 @@
-from langchain_huggingface import HuggingFaceEmbeddings
+from langchain_core.embeddings import Embeddings
+import threading
 
-# Initialize the embedding model
 # using clean, lightweight local model as requested
-embedding_model = HuggingFaceEmbeddings(
-    model_name="sentence-transformers/all-MiniLM-L6-v2"
-)
\ No newline at end of file
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+# all-MiniLM-L6-v2 reads at most 256 word-pieces (including [CLS] and [SEP]);
+# anything after that is silently truncated
+EMBEDDING_MAX_TOKENS = 256
+
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
+
+_model = None
+_model_lock = threading.Lock()
+_ready = threading.Event()
+
+
+def get_embedding_model():
+    """
+    Return the HuggingFace embedding model, loading it on first use.
+    torch and sentence-transformers are only imported here, so importing
+    this module (and everything that depends on it) stays cheap.
+    The model is returned (and reported ready) only after one warm-up encode.
+    """
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                from langchain_huggingface import HuggingFaceEmbeddings
+                model = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
+                # The first encode is much slower than the rest
+                model.embed_query("warm up")
+                _model = model
+                _ready.set()
+    return _model
+
+
+def get_tokenizer():
+    """
+    The embedding model's word-piece tokenizer, or None if it can't be
+    loaded. Only the tokenizer files are loaded, not the model weights.
+    """
+    global _tokenizer
+    if _tokenizer is None:
+        with _tokenizer_lock:
+            if _tokenizer is None:
+                try:
+                    from transformers import AutoTokenizer
+                    _tokenizer = AutoTokenizer.from_pretrained(EMBEDDING_MODEL_NAME)
+                except Exception as e:
+                    print(f"Embedding tokenizer unavailable ({e}); estimating chunk tokens from length")
+                    _tokenizer = False
+    return _tokenizer or None
+
+
+def is_embedding_model_ready() -> bool:
+    """
+    True once the embedding model is loaded and warm.
+    """
+    return _ready.is_set()
+
+
+def warm_up_embeddings(background: bool = True):
+    """
+    Load the model and run one encode so the first real query is fast.
+    By default this runs in a daemon thread and returns immediately.
+    """
+    def _warm_up():
+        try:
+            get_embedding_model()
+            print("Embedding model is warm")
+        except Exception as e:
+            print(f"Embedding warm-up failed: {e}")
+
+    if not background:
+        _warm_up()
+        return None
+
+    thread = threading.Thread(target=_warm_up, name="embedding-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+class LazyEmbeddings(Embeddings):
+    """
+    Embeddings proxy that defers loading the model until it is first used.
+    """
+
+    def embed_documents(self, texts):
+        return get_embedding_model().embed_documents(texts)
+
+    def embed_query(self, text):
+        return get_embedding_model().embed_query(text)
+
+
+# Initialize the embedding model (loaded lazily on first embed call)
+embedding_model = LazyEmbeddings()
@@ -1,52 +1,560 @@
-from rag_loader import load_and_split_document
+from rag_loader import count_pages, iter_chunk_batches
 from rag_embeddings import embedding_model
-from rag_vectorstore import create_vector_store, load_vector_store, clear_vector_store
-from rag_retriever import retrieve_context
+from config import RAG_EMBED_BATCH_SIZE, RAG_FETCH_FACTOR, RAG_RARE_TERM_FRACTION, RAG_SERVING_MODE, RAG_SERVING_REFRESH_SECONDS
+from rag_vectorstore import PendingSegment, append_stored_vectors, clone_vector_store, commit_segment, compact_vector_store, current_base, index_generation, index_lock, load_vector_store, clear_vector_store, merge_segment, rebuild_vector_store, rank_positions, rank_positions_many, remove_from_vector_store, search_many
+from rag_index_policy import describe_index, needs_rebuild, read_policy_report, write_policy_report
+from rag_retriever import check_mode, reciprocal_rank_scores
+from rag_context import assemble_context, normalize_rows
+from rag_cache import QueryCache
+from rag_relevance import relevance_threshold, relevant
+from rag_summaries import build_summary, clear_summaries, llm_summarize, read_summaries, write_summaries
+from rag_routing import FileRouter, clear_file_vectors, file_vectors, read_file_vectors, write_file_vectors
+from rag_registry import index_registry
+from rag_documents import collect_garbage, hash_file
+from rag_files import write_json
+from rag_chunkstore import ChunkIdMap, ChunkStoreDocstore, SourcePositions, get_chunk_store
+from langchain_core.documents import Document
+from contextlib import contextmanager
+import numpy as np
+import re
+import threading
+import time
+import uuid
+
+READ_ONLY_MESSAGE = "The knowledge base is read-only in this worker (RAG_SERVING_MODE=readonly)."
 
 class RAGEngine:
-    def __init__(self):
+    def __init__(self, registry=None):
+        """
+        Initialize the RAG engine on top of the shared index registry,
+        loading the vector store from disk the first time.
+        In read-only serving mode the index is memory-mapped and never written.
+        """
+        self.registry = registry or index_registry
+        self.read_only = RAG_SERVING_MODE == "readonly"
+        self._rebuild_thread = None
+        self._rebuild_lock = threading.Lock()
+        self._serving_base = None
+        self._next_refresh = 0.0
+        self.query_cache = QueryCache()
+        self._position_index = (None, {})
+        self._position_index_lock = threading.Lock()
+        self._file_router = (None, None)
+        self._file_router_lock = threading.Lock()
+        if self.read_only:
+            with self.registry.write_lock:
+                if not self.registry.loaded:
+                    self.registry.publish(*self._load_index())
+            return
+        with self._writing():
+            pass  # loads the index unless this process already has the current one
+        # Drop stored uploads whose ingestion never completed
+        self.collect_garbage()
+        self._backfill_file_vectors()
+        self.schedule_index_rebuild()
+
+    @property
+    def vector_store(self):
+        """The vector store of the current index version."""
+        return self.registry.snapshot().vector_store
+
+    @property
+    def index_version(self) -> int:
+        """Incremented every time a new index is published."""
+        return self.registry.version
+
+    def _load_index(self) -> tuple:
+        """
+        Load the vector store and its filename index from disk.
+        Returns (vector_store, source_index, source_positions).
+        """
+        if self.read_only:
+            self._serving_base = current_base()
+            vector_store = load_vector_store(embedding_model, read_only=True)
+            if vector_store is not None and isinstance(vector_store.index_to_docstore_id, ChunkIdMap):
+                # Chunk positions per file are looked up in the chunk store when needed
+                ids = vector_store.index_to_docstore_id
+                return vector_store, {}, SourcePositions(ids.store, ids.name)
+        else:
+            vector_store = load_vector_store(embedding_model)
+        source_index, source_positions = self._load_source_index(vector_store)
+        return vector_store, source_index, source_positions
+
+    def _refresh_index(self):
+        """
+        Pick up index changes made by other processes, checked at most every
+        RAG_SERVING_REFRESH_SECONDS: in read-only mode a newly compacted base
+        written by the ingesting process, in read-write mode segments and
+        compactions written by other read-write processes.
+        """
+        if time.monotonic() < self._next_refresh:
+            return
+        self._next_refresh = time.monotonic() + RAG_SERVING_REFRESH_SECONDS
+        if not self.read_only:
+            if index_generation() != self.registry.generation:
+                with self._writing():
+                    pass
+            return
+        if current_base() == self._serving_base:
+            return
+        with self.registry.write_lock:
+            if current_base() != self._serving_base:
+                self.registry.publish(*self._load_index())
+
+    @contextmanager
+    def _writing(self):
         """
-        Initialize the RAG engine by loading the vector store.
+        Hold the write locks: the registry's (other threads) and index_lock
+        (other processes sharing rag_index). If another process wrote to the
+        index since this one last loaded it, it is reloaded first, so writes
+        always build on everything on disk.
         """
-        self.vector_store = load_vector_store(embedding_model)
+        with self.registry.write_lock, index_lock:
+            if self.registry.generation != index_generation():
+                self._publish(*self._load_index())
+            yield
+
+    def _publish(self, vector_store, source_index: dict, source_positions: dict):
+        """Publish a new index version written or loaded under _writing()."""
+        self.registry.publish(vector_store, source_index, source_positions)
+        self.registry.generation = index_generation()
 
-    def process_file(self, file_path: str, filename: str) -> tuple[bool, str]:
+    def process_file(self, file_path: str, filename: str, progress=None, content_hash: str = None) -> tuple[bool, str]:
         """
         Process a file and update the vector store.
+        Files whose content is already in the knowledge base are not re-embedded.
+        
+        Args:
+            file_path: Path of the saved upload
+            filename: Name the document is listed and tagged under
+            progress: Optional callback progress(stage, **counts) for job status
+            content_hash: SHA-256 of the file, if the caller already computed it
         """
+        progress = progress or (lambda stage, **counts: None)
+        if self.read_only:
+            return False, READ_ONLY_MESSAGE
         try:
-            chunks = load_and_split_document(file_path)
-            self.vector_store = create_vector_store(chunks, embedding_model)
-            # Track document metadata
-            self.add_document_metadata(filename, len(chunks))
-            return True, f"Successfully processed {filename}. Added {len(chunks)} chunks to knowledge base."
+            content_hash = content_hash or hash_file(file_path)
+            existing = self.find_document_by_hash(content_hash)
+            if existing:
+                return True, self._duplicate_message(filename, existing)
+            
+            progress("loading", pages_total=count_pages(file_path))
+            
+            # Stream pages -> chunks -> embeddings in fixed-size batches; each
+            # batch's chunks go to the chunk store and its vectors to a temp
+            # file, so peak memory depends on the batch size rather than on
+            # the document. Nothing here needs the write lock.
+            pending = PendingSegment()
+            committed = False
+            try:
+                for batch in iter_chunk_batches(file_path, RAG_EMBED_BATCH_SIZE, source=filename):
+                    vectors = embedding_model.embed_documents([chunk.page_content for chunk in batch])
+                    pending.add(batch, vectors, [str(uuid.uuid4()) for _ in batch])
+                    progress(
+                        "embedding",
+                        pages_parsed=batch[-1].metadata.get('page', 0) + 1,
+                        chunks_embedded=len(pending.ids)
+                    )
+                
+                ids = pending.ids
+                if not ids:
+                    return False, f"No text could be extracted from {filename}."
+                
+                progress("indexing")
+                routing_vectors = file_vectors(pending.vectors())
+                with self._writing():
+                    # The same content may have been ingested while we were embedding
+                    existing = self.find_document_by_hash(content_hash)
+                    if existing:
+                        return True, self._duplicate_message(filename, existing)
+                    
+                    snapshot = self.registry.snapshot()
+                    # Copy-on-write: readers keep using the current version until
+                    # the updated index is published below
+                    vector_store = clone_vector_store(snapshot.vector_store) if snapshot.vector_store else None
+                    start = vector_store.index.ntotal if vector_store else 0
+                    # Merge into the live index; only the new segment is written to disk
+                    vector_store = commit_segment(vector_store, pending.to_segment(embedding_model))
+                    committed = True
+                    # Only this file's lists are new; the other files' are shared with the snapshot
+                    source_index = dict(snapshot.source_index)
+                    source_positions = dict(snapshot.source_positions)
+                    source_index[filename] = source_index.get(filename, []) + ids
+                    source_positions[filename] = source_positions.get(filename, []) + list(range(start, start + len(ids)))
+                    # Track document metadata
+                    self.add_document_metadata(filename, len(ids), content_hash=content_hash, stored_path=file_path)
+                    self._update_file_vectors({filename: routing_vectors})
+                    self._publish(vector_store, source_index, source_positions)
+            finally:
+                pending.close(discard=not committed)
+            self.schedule_index_rebuild()
+            return True, f"Successfully processed {filename}. Added {len(ids)} chunks to knowledge base."
         except Exception as e:
             return False, f"Error processing file: {str(e)}"
 
-    def retrieve(self, query: str, k: int = 3) -> list[str]:
+    def ingest_bulk(self, segment, files: list) -> dict:
+        """
+        Add many embedded documents at once (see bulk_ingest.py). files holds
+        one dict per document: filename, content_hash, stored_path and
+        positions (of its chunks within segment). The merged index is rebuilt
+        if the index policy wants a different type for its size and written
+        as a single new base; the filename index, document metadata and
+        routing vectors are each replaced once.
+        """
+        if self.read_only:
+            raise RuntimeError(READ_ONLY_MESSAGE)
+        segment_ids = segment.index_to_docstore_id
+        with self._writing():
+            snapshot = self.registry.snapshot()
+            vector_store = clone_vector_store(snapshot.vector_store) if snapshot.vector_store else None
+            start = vector_store.index.ntotal if vector_store else 0
+            vector_store = merge_segment(vector_store, segment)
+            if needs_rebuild(vector_store.index):
+                vector_store, vectors = rebuild_vector_store(vector_store)
+                report = describe_index(vector_store.index, vectors)
+                report["ntotal"] = int(vector_store.index.ntotal)
+                write_policy_report(report)
+            compact_vector_store(vector_store, force=True)
+            
+            source_index = dict(snapshot.source_index)
+            source_positions = dict(snapshot.source_positions)
+            documents = self._read_document_metadata()
+            routing = {}
+            for entry in files:
+                filename, positions = entry["filename"], entry["positions"]
+                source_index[filename] = source_index.get(filename, []) + [segment_ids[pos] for pos in positions]
+                source_positions[filename] = source_positions.get(filename, []) + [start + pos for pos in positions]
+                documents.append(self._document_record(filename, len(positions), entry["content_hash"], entry["stored_path"]))
+                routing[filename] = file_vectors(segment.index.reconstruct_batch(np.array(positions, dtype=np.int64)))
+            self._write_document_metadata(documents)
+            self._update_file_vectors(routing)
+            self._publish(vector_store, source_index, source_positions)
+        return {
+            "documents": len(files),
+            "chunks": int(segment.index.ntotal),
+            "ntotal": int(vector_store.index.ntotal),
+            "index_type": describe_index(vector_store.index)["index_type"],
+        }
+
+    def find_document_by_hash(self, content_hash: str):
+        """
+        Return the metadata record of an already-ingested document with this content, if any.
+        """
+        for document in self._read_document_metadata():
+            if document.get("content_hash") == content_hash:
+                return document
+        return None
+
+    def _duplicate_message(self, filename: str, existing: dict) -> str:
+        if existing["filename"] == filename:
+            return f"{filename} is already in the knowledge base. Skipped re-processing."
+        return f"{filename} has the same content as {existing['filename']}, which is already in the knowledge base. Skipped re-processing."
+
+    def collect_garbage(self) -> list:
+        """
+        Remove stored uploads that no document metadata record references.
+        """
+        with self._writing():
+            referenced = [doc.get("content_hash") for doc in self._read_document_metadata()]
+            return collect_garbage([h for h in referenced if h])
+
+    def schedule_index_rebuild(self) -> bool:
+        """
+        Start a background rebuild if the index policy wants a different index
+        for the current corpus size (e.g. flat -> HNSW past RAG_FLAT_MAX_CHUNKS).
+        Searches keep using the current index until the rebuilt one is published.
+        """
+        vector_store = self.vector_store
+        if self.read_only or vector_store is None or not needs_rebuild(vector_store.index):
+            return False
+        with self._rebuild_lock:
+            if self._rebuild_thread is not None and self._rebuild_thread.is_alive():
+                return False
+            self._rebuild_thread = threading.Thread(target=self._rebuild_index, name="index-rebuild", daemon=True)
+            self._rebuild_thread.start()
+        return True
+
+    def _rebuild_index(self):
+        """
+        Rebuild the index outside the write lock (training can take a while),
+        then catch up with chunks appended meanwhile and publish it.
+        """
+        snapshot = self.registry.snapshot()
+        try:
+            rebuilt, vectors = rebuild_vector_store(snapshot.vector_store)
+            report = describe_index(rebuilt.index, vectors)
+        except Exception as e:
+            print(f"Index rebuild failed: {e}")
+            return
+        
+        with self._writing():
+            current = self.registry.snapshot()
+            if current.vector_store is None:
+                return
+            built_ids = snapshot.vector_store.index_to_docstore_id
+            current_ids = current.vector_store.index_to_docstore_id
+            if any(current_ids.get(pos) != doc_id for pos, doc_id in built_ids.items()):
+                # A document was deleted meanwhile; the next change retries
+                print("Index changed during rebuild; discarding rebuilt index.")
+                return
+            append_stored_vectors(rebuilt, current.vector_store, start=len(built_ids))
+            compact_vector_store(rebuilt, force=True)
+            report["ntotal"] = int(rebuilt.index.ntotal)
+            write_policy_report(report)
+            self._publish(rebuilt, current.source_index, current.source_positions)
+        print(f"Index rebuilt as {report['index_type']} ({report['ntotal']} chunks, recall@{report.get('k', '-')}: {report.get('recall_at_k', 1.0)})")
+
+    def retrieve(self, query: str, k: int = 3, mode: str = None) -> list[str]:
         """
         Retrieve relevant context for a query.
+        mode: "dense" or "hybrid" (see rag_retriever); defaults to config.RAG_RETRIEVAL_MODE.
+        """
+        return [text for text, _ in self.retrieve_with_scores(query, k, mode)]
+
+    def retrieve_with_scores(self, query: str, k: int = 3, mode: str = None) -> list[tuple[str, float]]:
+        """
+        (chunk, cosine similarity to the query) pairs, best first. Only chunks
+        that clear the relevance threshold are returned, at most k of them
+        (see rag_relevance); an off-topic query gets an empty list.
+        """
+        self._refresh_index()
+        docs = self._retrieve_documents(self.registry.snapshot(), query, k, mode)
+        return [(doc.page_content, doc.metadata["score"]) for doc in docs]
+
+    def retrieve_many(self, queries: list, k: int = 3, mode: str = None) -> list[list[str]]:
+        """
+        Retrieve context for several queries at once (quiz generation, query
+        expansion, evaluation sets). Uncached queries are embedded in one
+        batch and searched with a single multi-row FAISS search; when file
+        routing is active, with one search per set of files they route to.
+        Returns one list of chunks per query, as retrieve would.
         """
-        # We need to access the internal 'similarity_search' of vectorstore or just use the helper 
-        # But 'retrieve_context' helper returns a string, so we might want to expose raw docs if needed 
-        # or just reuse the helper for the text.
-        # The original 'retrieve' returned a list of strings.
+        self._refresh_index()
+        snapshot = self.registry.snapshot()
+        vector_store = snapshot.vector_store
+        if vector_store is None:
+            return [[] for _ in queries]
+        mode = check_mode(mode)
+        threshold = relevance_threshold()
         
-        if self.vector_store is None:
+        results = [self.query_cache.cached_documents(query, snapshot.version, k, mode, threshold) for query in queries]
+        missing = [i for i, docs in enumerate(results) if docs is None]
+        if missing:
+            texts = [queries[i] for i in missing]
+            # HuggingFaceEmbeddings encodes queries and documents the same way
+            embeddings = self.query_cache.embeddings_many(texts, embedding_model.embed_documents)
+            router = self._router(snapshot)
+            if router.active:
+                # Queries routed to the same files share one multi-row search
+                groups = {}
+                for j, query_embedding in enumerate(embeddings):
+                    groups.setdefault(tuple(sorted(router.route(query_embedding))), []).append(j)
+                found = [None] * len(embeddings)
+                for filenames, members in groups.items():
+                    filenames = list(filenames)
+                    positions = self._positions_for_files(filenames, snapshot.source_positions)
+                    ranked = rank_positions_many(vector_store, [embeddings[j] for j in members], k * RAG_FETCH_FACTOR, positions)
+                    for j, (candidates, _) in zip(members, ranked):
+                        found[j] = (filenames, candidates)
+            else:
+                found = [(None, candidates) for candidates, _ in search_many(vector_store, embeddings, k * RAG_FETCH_FACTOR)]
+            for i, query_embedding, (filenames, candidates) in zip(missing, embeddings, found):
+                docs = self._select_context(snapshot, queries[i], query_embedding, candidates, k, mode, filenames, threshold)
+                self.query_cache.store_documents(queries[i], snapshot.version, docs, k, mode, threshold)
+                results[i] = docs
+        return [[doc.page_content for doc in docs] for docs in results]
+
+    def _embed_query(self, query: str):
+        """Query embedding, from the query cache when the query was seen before."""
+        return self.query_cache.embedding(query, embedding_model.embed_query)
+
+    def _retrieve_documents(self, snapshot, query: str, k: int, mode: str = None) -> list:
+        """Top-k Documents for a query against one index snapshot (cached per index version)."""
+        vector_store = snapshot.vector_store
+        if vector_store is None:
             return []
-            
-        docs = self.vector_store.similarity_search(query, k=k)
+        mode = check_mode(mode)
+        # The threshold is part of the key, so recalibrating takes effect at once
+        threshold = relevance_threshold()
+        return self.query_cache.documents(
+            query, snapshot.version,
+            lambda: self._assemble_context(snapshot, query, k, mode, threshold=threshold),
+            k, mode, threshold
+        )
+
+    def _assemble_context(self, snapshot, query: str, k: int, mode: str, positions: list = None,
+                          filenames: list = None, threshold: float = None) -> list:
+        """
+        Gather k * RAG_FETCH_FACTOR candidate chunks (nearest vectors, fused
+        with BM25 hits in hybrid mode, restricted to the given FAISS positions
+        or else to the files the query is routed to), then let rag_context
+        pick k of them with MMR over their stored vectors and trim the text
+        they repeat.
+        """
+        query_embedding = self._embed_query(query)
+        if positions is None:
+            filenames, positions = self._route(snapshot, query_embedding)
+        candidates = rank_positions(snapshot.vector_store, query_embedding, k * RAG_FETCH_FACTOR, positions)[0]
+        return self._select_context(snapshot, query, query_embedding, candidates, k, mode, filenames, threshold)
+
+    def _select_context(self, snapshot, query: str, query_embedding, candidates, k: int, mode: str,
+                        filenames: list = None, threshold: float = None) -> list:
+        """
+        Fuse, MMR-select and trim the nearest-vector candidates of one query.
+        With a threshold, candidates that fail rag_relevance.relevant are
+        dropped first (possibly all of them), except, in hybrid mode, BM25
+        hits on a rare query term: an exact identifier can embed far from
+        the chunk that defines it. Each returned Document carries its cosine
+        similarity to the query as metadata["score"].
+        """
+        vector_store = snapshot.vector_store
+        fetch_k = k * RAG_FETCH_FACTOR
+        candidates = [int(pos) for pos in candidates]
+        
+        fused, rare, lexical = None, set(), set()
+        if mode == "hybrid" and isinstance(vector_store.docstore, ChunkStoreDocstore):
+            store = vector_store.docstore.store
+            lexical_ids = store.search_text(query, fetch_k, sources=filenames)
+            position_of = self._positions_of(snapshot, lexical_ids)
+            lexical = [position_of[doc_id] for doc_id in lexical_ids if doc_id in position_of]
+            fused = reciprocal_rank_scores([candidates, lexical])
+            candidates = sorted(fused, key=fused.get, reverse=True)
+            if threshold is not None and lexical:
+                # At least a few chunks, so small knowledge bases still have rare terms
+                max_chunks = max(5, int(RAG_RARE_TERM_FRACTION * vector_store.index.ntotal))
+                rare = set(store.rare_terms(query, max_chunks))
+                lexical = set(lexical)
+        
+        docs, kept = [], []
+        for pos in candidates:
+            doc = vector_store.docstore.search(vector_store.index_to_docstore_id[pos])
+            if isinstance(doc, str):
+                continue
+            docs.append(doc)
+            kept.append(pos)
+        if not docs:
+            return []
+        
+        # Stored vectors are read back from the index, nothing is re-embedded
+        vectors = vector_store.index.reconstruct_batch(np.array(kept, dtype=np.int64))
+        similarity = normalize_rows(vectors) @ normalize_rows([query_embedding])[0]
+        if threshold is not None:
+            mask = relevant(similarity, threshold)
+            if rare:
+                mask |= np.array([
+                    pos in lexical and not rare.isdisjoint(re.findall(r"\w+", doc.page_content.lower()))
+                    for doc, pos in zip(docs, kept)
+                ])
+            if not mask.any():
+                return []
+            docs = [doc for doc, keep in zip(docs, mask) if keep]
+            kept = [pos for pos, keep in zip(kept, mask) if keep]
+            vectors, similarity = vectors[mask], similarity[mask]
+        
+        docs = [
+            Document(id=doc.id, page_content=doc.page_content, metadata={**doc.metadata, "score": round(float(score), 4)})
+            for doc, score in zip(docs, similarity)
+        ]
+        if fused is not None:
+            relevance = np.array([fused[pos] for pos in kept]) / max(fused.values())
+        else:
+            relevance = similarity
+        return assemble_context(docs, relevance, vectors, k)
+
+    def _router(self, snapshot) -> FileRouter:
+        """The file router for a snapshot (built once per index version)."""
+        with self._file_router_lock:
+            if self._file_router[0] != snapshot.version:
+                filenames = list(snapshot.source_positions) if snapshot.vector_store is not None else []
+                self._file_router = (snapshot.version, FileRouter(filenames, read_file_vectors()))
+            return self._file_router[1]
+
+    def _route(self, snapshot, query_embedding) -> tuple:
+        """
+        (files, FAISS positions) to search for an untagged query, or
+        (None, None) to search everything (too few files for routing).
+        """
+        router = self._router(snapshot)
+        if not router.active:
+            return None, None
+        filenames = router.route(query_embedding)
+        return filenames, self._positions_for_files(filenames, snapshot.source_positions)
+
+    def _update_file_vectors(self, added: dict, removed: list = ()):
+        """Add or drop files' routing vectors (called under the write lock)."""
+        vectors_by_file = read_file_vectors()
+        for filename in removed:
+            vectors_by_file.pop(filename, None)
+        vectors_by_file.update(added)
+        write_file_vectors(vectors_by_file)
+
+    def _backfill_file_vectors(self):
+        """Compute routing vectors for files indexed before file routing existed."""
+        with self._writing():
+            snapshot = self.registry.snapshot()
+            if snapshot.vector_store is None:
+                return
+            known = read_file_vectors()
+            added = {}
+            for filename, positions in snapshot.source_positions.items():
+                if filename not in known and positions:
+                    vectors = snapshot.vector_store.index.reconstruct_batch(np.array(positions, dtype=np.int64))
+                    added[filename] = file_vectors(vectors)
+            if added:
+                self._update_file_vectors(added)
+                print(f"Computed routing vectors for {len(added)} files.")
+
+    def _positions_of(self, snapshot, doc_ids: list) -> dict:
+        """doc id -> FAISS position in the snapshot's index, for the given ids."""
+        ids = snapshot.vector_store.index_to_docstore_id
+        if isinstance(ids, ChunkIdMap):
+            return ids.positions_of(doc_ids)
+        with self._position_index_lock:
+            # Built once per index version
+            if self._position_index[0] != snapshot.version:
+                self._position_index = (snapshot.version, {doc_id: pos for pos, doc_id in ids.items()})
+            position_by_id = self._position_index[1]
+        return {doc_id: position_by_id[doc_id] for doc_id in doc_ids if doc_id in position_by_id}
+
+    def get_context_chunks(self, query: str, filenames: list = None, mode: str = None) -> list[str]:
+        """
+        Ranked context chunks (best first) for a query, restricted to the
+        given files if any. Used with format_context when the caller packs
+        chunks into a token budget itself (see prompt_packer).
+        Untagged queries only get chunks that clear the relevance threshold,
+        so the list is empty for off-topic turns; tagged files always
+        contribute, since the user asked for them.
+        """
+        self._refresh_index()
+        snapshot = self.registry.snapshot()
+        if filenames:
+            docs = self._file_documents(snapshot, query, filenames, mode) or []
+        else:
+            docs = self._retrieve_documents(snapshot, query, 3, mode)
         return [doc.page_content for doc in docs]
 
-    def get_formatted_context(self, query: str) -> str:
+    def format_context(self, chunks: list, filenames: list = None) -> str:
         """
-        Get context formatted as a string for the LLM prompt.
-        Includes anti-hallucination instructions.
+        Wrap context chunks in the anti-hallucination instructions for the
+        LLM prompt ("" if there are none).
         """
-        context = retrieve_context(query, self.vector_store)
+        context = "\n\n".join(chunks)
         if not context:
             return ""
         
+        if filenames:
+            return f"""CONTEXT FROM REFERENCED DOCUMENTS ({', '.join(filenames)}):
+---
+{context}
+---
+IMPORTANT: When answering, you MUST:
+1. Base your response PRIMARILY on the context from the referenced files above
+2. If information is not in the referenced files, say "This isn't covered in the referenced documents, but based on my knowledge..." before answering
+3. Never fabricate specific facts, quotes, or statistics
+4. Cite which document the information comes from when possible
+"""
+        
         # Anti-hallucination guardrails
         return f"""CONTEXT FROM USER'S UPLOADED DOCUMENTS:
 ---
@@ -59,7 +567,18 @@ IMPORTANT: When answering, you MUST:
 4. If asked about something not covered, honestly say it's not in the uploaded documents
 """
 
-    def get_formatted_context_for_files(self, query: str, filenames: list) -> str:
+    def get_formatted_context(self, query: str, mode: str = None) -> str:
+        """
+        Get context formatted as a string for the LLM prompt.
+        Includes anti-hallucination instructions.
+        """
+        return self.format_context(self.get_context_chunks(query, mode=mode))
+
+    def missing_files_message(self, filenames: list) -> str:
+        """Context text used when none of the tagged files are in the knowledge base."""
+        return f"(No content found from the specified files: {', '.join(filenames)}. Please ensure the files are uploaded to the knowledge base.)"
+
+    def get_formatted_context_for_files(self, query: str, filenames: list, mode: str = None) -> str:
         """
         Get context formatted as a string, filtered to specific files.
         When files are tagged, we retrieve ALL chunks from those files first,
@@ -68,107 +587,188 @@ IMPORTANT: When answering, you MUST:
         Args:
             query: The user's question
             filenames: List of filenames to filter results to
+            mode: "dense" or "hybrid" ranking within the files
         """
-        if self.vector_store is None:
+        # Pin one index version for the whole request
+        self._refresh_index()
+        snapshot = self.registry.snapshot()
+        if snapshot.vector_store is None:
             return ""
         
-        # First, get ALL documents from the specified files
-        all_matching_docs = []
-        try:
-            for doc_id, doc in self.vector_store.docstore._dict.items():
-                doc_source = doc.metadata.get('source', '')
-                for filename in filenames:
-                    # Match filename at the end of the path or as substring
-                    if filename in doc_source or doc_source.endswith(filename):
-                        all_matching_docs.append(doc)
-                        break
-        except Exception as e:
-            print(f"Error accessing docstore: {e}")
-            # Fallback: try similarity search with a generic query
-            all_matching_docs = []
-        
-        if not all_matching_docs:
-            return f"(No content found from the specified files: {', '.join(filenames)}. Please ensure the files are uploaded to the knowledge base.)"
-        
-        # If we have matching docs, use similarity search within them
-        # to find the most relevant chunks for the query
-        if len(all_matching_docs) <= 3:
-            # If we have 3 or fewer chunks, use them all
-            filtered_docs = all_matching_docs
-        else:
-            # Use the embedding model to find most relevant chunks
-            try:
-                from rag_embeddings import embedding_model
-                import numpy as np
-                
-                # Get query embedding
-                query_embedding = embedding_model.embed_query(query)
-                
-                # Get embeddings for all matching docs and calculate similarity
-                doc_similarities = []
-                for doc in all_matching_docs:
-                    doc_embedding = embedding_model.embed_query(doc.page_content)
-                    # Cosine similarity
-                    similarity = np.dot(query_embedding, doc_embedding) / (
-                        np.linalg.norm(query_embedding) * np.linalg.norm(doc_embedding)
-                    )
-                    doc_similarities.append((doc, similarity))
-                
-                # Sort by similarity and take top 5
-                doc_similarities.sort(key=lambda x: x[1], reverse=True)
-                filtered_docs = [doc for doc, _ in doc_similarities[:5]]
-            except Exception as e:
-                print(f"Error during similarity ranking: {e}")
-                # Fallback: just take first 5 docs
-                filtered_docs = all_matching_docs[:5]
+        docs = self._file_documents(snapshot, query, filenames, mode)
+        if docs is None:
+            return self.missing_files_message(filenames)
+        return self.format_context([doc.page_content for doc in docs], filenames)
+
+    def _file_documents(self, snapshot, query: str, filenames: list, mode: str = None):
+        """
+        The most relevant chunks of the tagged files, or None if none of the
+        files are in the knowledge base.
+        """
+        if snapshot.vector_store is None:
+            return None
+        mode = check_mode(mode)
         
-        context = "\n\n".join([doc.page_content for doc in filtered_docs])
+        # Look up the tagged files' chunks in the filename index
+        matched_files = self._matching_files(filenames, snapshot.source_positions)
+        positions = self._positions_for_files(matched_files, snapshot.source_positions)
+        if not positions:
+            return None
         
-        # Anti-hallucination guardrails
-        return f"""CONTEXT FROM REFERENCED DOCUMENTS ({', '.join(filenames)}):
----
-{context}
----
-IMPORTANT: When answering, you MUST:
-1. Base your response PRIMARILY on the context from the referenced files above
-2. If information is not in the referenced files, say "This isn't covered in the referenced documents, but based on my knowledge..." before answering
-3. Never fabricate specific facts, quotes, or statistics
-4. Cite which document the information comes from when possible
-"""
+        return self.query_cache.documents(
+            query, snapshot.version,
+            lambda: self._rank_file_chunks(snapshot, query, matched_files, positions, mode),
+            5, mode, tuple(sorted(matched_files))
+        )
+
+    def _rank_file_chunks(self, snapshot, query: str, filenames: list, positions: list, mode: str) -> list:
+        """
+        The most relevant chunks among the given FAISS positions (the chunks
+        of the tagged files), best first. Only the tagged files' vectors are
+        searched, so the cost scales with the files rather than the corpus.
+        """
+        vector_store = snapshot.vector_store
+        try:
+            return self._assemble_context(snapshot, query, 5, mode, positions, filenames)
+        except Exception as e:
+            print(f"Error during similarity ranking: {e}")
+            # Fallback: just take first 5 docs
+            return [
+                vector_store.docstore.search(vector_store.index_to_docstore_id[pos])
+                for pos in positions[:5]
+            ]
 
     def clear_knowledge_base(self) -> bool:
         """
         Clear all documents from the knowledge base.
         """
-        result = clear_vector_store()
-        self.vector_store = None
-        # Also clear the document metadata
-        self._clear_document_metadata()
+        if self.read_only:
+            return False
+        with self._writing():
+            result = clear_vector_store()
+            self._publish(None, {}, {})
+            # Also clear the document metadata
+            self._clear_document_metadata()
+            clear_file_vectors()
+            clear_summaries()
         return result
     
-    def get_knowledge_base_info(self) -> dict:
+    def delete_document(self, filename: str) -> tuple[bool, str]:
         """
-        Get information about all documents in the knowledge base.
-        Returns list of documents with their metadata.
+        Remove one document from the knowledge base without touching the rest:
+        its vectors and docstore entries are removed from the index, its
+        metadata record dropped, and its stored file deleted.
         """
         import os
-        import json
         
-        metadata_file = "rag_index/documents_metadata.json"
-        documents = []
+        if self.read_only:
+            return False, READ_ONLY_MESSAGE
+        with self._writing():
+            snapshot = self.registry.snapshot()
+            doc_ids = snapshot.source_index.get(filename, [])
+            documents = self._read_document_metadata()
+            removed = [doc for doc in documents if doc["filename"] == filename]
+            if not doc_ids and not removed:
+                return False, f"{filename} is not in the knowledge base."
+            
+            remaining = [doc for doc in documents if doc["filename"] != filename]
+            source_index = {name: ids for name, ids in snapshot.source_index.items() if name != filename}
+            
+            vector_store = None
+            if snapshot.vector_store is not None:
+                vector_store = remove_from_vector_store(clone_vector_store(snapshot.vector_store), doc_ids)
+                if vector_store.index.ntotal == 0:
+                    vector_store = None
+            
+            if vector_store is None:
+                # Nothing left to search; drop the index files but keep the
+                # remaining metadata records (if any) consistent. The chunk
+                # store stays for uploads that are being embedded right now.
+                clear_vector_store(keep_chunks=True)
+                source_index = {}
+            else:
+                # Deletions can't be expressed as an append-only segment;
+                # rewrite the base from memory (no re-embedding)
+                compact_vector_store(vector_store, force=True)
+            
+            self._write_document_metadata(remaining)
+            self._update_file_vectors({}, removed=[filename])
+            summaries = read_summaries()
+            if summaries.pop(filename, None) is not None:
+                write_summaries(summaries)
+            self._publish(vector_store, source_index, self._positions_for_source_index(vector_store, source_index))
+            get_chunk_store().delete(doc_ids)
+            
+            # Delete stored uploads only this document referenced
+            still_referenced = {doc.get("content_hash") for doc in remaining}
+            for doc in removed:
+                path = doc.get("stored_path")
+                if doc.get("content_hash") not in still_referenced and path and os.path.exists(path):
+                    os.remove(path)
         
-        if os.path.exists(metadata_file):
-            try:
-                with open(metadata_file, 'r') as f:
-                    documents = json.load(f)
-            except:
-                pass
+        self.schedule_index_rebuild()
+        return True, f"Removed {filename} ({len(doc_ids)} chunks) from the knowledge base."
+
+    def summarize_document(self, filename: str, summarize=None, force: bool = False) -> bool:
+        """
+        Build the hierarchical summary of an ingested document (see
+        rag_summaries) and save it in summaries.json. The LLM calls run
+        outside the write lock; returns False if the document is gone, has
+        no chunks or (unless force) already has a summary.
+        """
+        if self.read_only:
+            return False
+        if not force and filename in read_summaries():
+            return False
+        snapshot = self.registry.snapshot()
+        if snapshot.vector_store is None:
+            return False
+        vector_store = snapshot.vector_store
+        # Positions follow ingestion order, which is document order
+        chunks = []
+        for pos in sorted(snapshot.source_positions.get(filename, [])):
+            doc = vector_store.docstore.search(vector_store.index_to_docstore_id[pos])
+            if not isinstance(doc, str):
+                chunks.append(doc.page_content)
+        if not chunks:
+            return False
+        
+        summary = build_summary(filename, chunks, summarize or llm_summarize)
+        with self._writing():
+            # The document may have been deleted while it was being summarized
+            if not any(doc["filename"] == filename for doc in self._read_document_metadata()):
+                return False
+            summaries = read_summaries()
+            summaries[filename] = summary
+            write_summaries(summaries)
+        return True
+
+    def get_document_summaries(self, filenames: list):
+        """
+        filename -> stored summary for the tagged files, or None unless every
+        tagged file resolves to a document that has one.
+        """
+        summaries = read_summaries()
+        summary_by_file = {doc["filename"]: summaries.get(doc["filename"]) for doc in self._read_document_metadata()}
+        matched = self._matching_files(filenames, summary_by_file)
+        if not matched or len(matched) < len(filenames) or not all(summary_by_file[name] for name in matched):
+            return None
+        return {name: summary_by_file[name] for name in matched}
+
+    def get_knowledge_base_info(self) -> dict:
+        """
+        Get information about all documents in the knowledge base.
+        Returns list of documents with their metadata.
+        """
+        self._refresh_index()
+        documents = self._read_document_metadata()
         
         # Get total chunks from vector store
+        vector_store = self.vector_store
         total_chunks = 0
-        if self.vector_store:
+        if vector_store:
             try:
-                total_chunks = len(self.vector_store.docstore._dict)
+                total_chunks = len(vector_store.index_to_docstore_id)
             except:
                 pass
         
@@ -176,16 +776,94 @@ IMPORTANT: When answering, you MUST:
             "documents": documents,
             "total_documents": len(documents),
             "total_chunks": total_chunks,
-            "has_content": self.vector_store is not None and total_chunks > 0
+            "has_content": vector_store is not None and total_chunks > 0,
+            "index": read_policy_report() if vector_store else {},
+            "relevance_threshold": relevance_threshold(),
+            "read_only": self.read_only
+        }
+    
+    def _matching_files(self, filenames: list, source_positions: dict) -> list:
+        """
+        Resolve tagged filenames to indexed filenames. Exact names are looked
+        up directly; otherwise fall back to matching against the (small) set
+        of indexed filenames.
+        """
+        matched = []
+        for filename in filenames:
+            if filename in source_positions:
+                matched.append(filename)
+                continue
+            for indexed_name in source_positions:
+                if filename in indexed_name or indexed_name.endswith(filename):
+                    matched.append(indexed_name)
+        return list(dict.fromkeys(matched))
+
+    def _positions_for_files(self, filenames: list, source_positions: dict) -> list:
+        """FAISS positions of the chunks of the given indexed filenames."""
+        positions = []
+        for filename in filenames:
+            positions.extend(source_positions.get(filename, []))
+        return sorted(set(positions))
+
+    def _load_source_index(self, vector_store) -> tuple[dict, dict]:
+        """
+        Build the filename index of a vector store from the chunk store's
+        source column, so ingests and deletes only update it in memory.
+        Returns (filename -> docstore ids, filename -> FAISS positions).
+        """
+        import os
+        
+        if vector_store is None:
+            return {}, {}
+        
+        source_index, source_positions = {}, {}
+        if isinstance(vector_store.docstore, ChunkStoreDocstore):
+            sources = vector_store.docstore.store.chunk_sources()
+            for position, doc_id in vector_store.index_to_docstore_id.items():
+                filename = sources.get(doc_id)
+                if filename is not None:
+                    source_index.setdefault(filename, []).append(doc_id)
+                    source_positions.setdefault(filename, []).append(position)
+            return source_index, source_positions
+        
+        # A legacy index loaded without migrating it to the chunk store; its
+        # chunks recorded the saved upload's path as the source
+        for doc_id in vector_store.index_to_docstore_id.values():
+            doc = vector_store.docstore.search(doc_id)
+            filename = os.path.basename(doc.metadata.get('source', ''))
+            source_index.setdefault(filename, []).append(doc_id)
+        return source_index, self._positions_for_source_index(vector_store, source_index)
+
+    def _positions_for_source_index(self, vector_store, source_index: dict) -> dict:
+        """Map filename -> current FAISS positions of its chunks."""
+        if vector_store is None:
+            return {}
+        position_by_id = {doc_id: pos for pos, doc_id in vector_store.index_to_docstore_id.items()}
+        return {
+            filename: [position_by_id[doc_id] for doc_id in doc_ids if doc_id in position_by_id]
+            for filename, doc_ids in source_index.items()
         }
+
+    def _read_document_metadata(self) -> list:
+        """Load the list of document metadata records."""
+        import os
+        import json
+        
+        metadata_file = "rag_index/documents_metadata.json"
+        if os.path.exists(metadata_file):
+            try:
+                with open(metadata_file, 'r') as f:
+                    return json.load(f)
+            except:
+                pass
+        return []
     
-    def add_document_metadata(self, filename: str, chunks_count: int):
+    def add_document_metadata(self, filename: str, chunks_count: int, content_hash: str = None, stored_path: str = None):
         """
         Store metadata about uploaded documents.
         """
         import os
         import json
-        from datetime import datetime
         
         metadata_dir = "rag_index"
         metadata_file = os.path.join(metadata_dir, "documents_metadata.json")
@@ -194,24 +872,29 @@ IMPORTANT: When answering, you MUST:
         os.makedirs(metadata_dir, exist_ok=True)
         
         # Load existing metadata
-        documents = []
-        if os.path.exists(metadata_file):
-            try:
-                with open(metadata_file, 'r') as f:
-                    documents = json.load(f)
-            except:
-                pass
+        documents = self._read_document_metadata()
         
         # Add new document
-        documents.append({
-            "filename": filename,
-            "chunks": chunks_count,
-            "uploaded_at": datetime.now().isoformat()
-        })
+        documents.append(self._document_record(filename, chunks_count, content_hash, stored_path))
         
         # Save metadata
-        with open(metadata_file, 'w') as f:
-            json.dump(documents, f, indent=2)
+        self._write_document_metadata(documents)
+    
+    def _document_record(self, filename: str, chunks_count: int, content_hash: str = None, stored_path: str = None) -> dict:
+        """Metadata record of one ingested document."""
+        from datetime import datetime
+        
+        return {
+            "filename": filename,
+            "chunks": chunks_count,
+            "uploaded_at": datetime.now().isoformat(),
+            "content_hash": content_hash,
+            "stored_path": stored_path
+        }
+    
+    def _write_document_metadata(self, documents: list):
+        """Atomically replace the document metadata file."""
+        write_json("rag_index/documents_metadata.json", documents, indent=2)
     
     def _clear_document_metadata(self):
         """Clear the document metadata file."""
@@ -219,3 +902,19 @@ IMPORTANT: When answering, you MUST:
         metadata_file = "rag_index/documents_metadata.json"
         if os.path.exists(metadata_file):
             os.remove(metadata_file)
+
+
+_shared_engine = None
+_shared_engine_lock = threading.Lock()
+
+def get_rag_engine() -> RAGEngine:
+    """
+    Return the process-wide RAGEngine shared by the app and the tutorial agent.
+    """
+    global _shared_engine
+    if _shared_engine is None:
+        with _shared_engine_lock:
+            if _shared_engine is None:
+                _shared_engine = RAGEngine()
+    return _shared_engine
+
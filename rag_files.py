@@ -0,0 +1,20 @@
+"""
+Atomic writes for the JSON files under rag_index/.
+
+Readers (other threads, other processes, read-only serving workers) may open
+these files at any moment, so they are never written in place: the data goes
+to a temp file next to the target, which then replaces it with os.replace.
+A reader sees either the old file or the new one, never a partial write.
+"""
+
+import json
+import os
+
+
+def write_json(path: str, data, indent: int = None):
+    """Atomically replace the JSON file at path, creating its directory if needed."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=indent)
+    os.replace(tmp_path, path)
@@ -0,0 +1,281 @@
+"""
+Index policy for the RAG vector store.
+
+Small knowledge bases are searched with an exact flat L2 index. Once the
+index holds config.RAG_FLAT_MAX_CHUNKS chunks, RAGEngine rebuilds it in the
+background as an approximate index (config.RAG_INDEX_TYPE: "hnsw" or "ivf"),
+so search cost stops growing linearly with the corpus. Every rebuild measures
+recall and latency against exact search and writes the result to
+rag_index/index_policy.json.
+
+Search-time knobs: config.RAG_IVF_NPROBE (IVF lists scanned per query) and
+config.RAG_HNSW_EF_SEARCH (HNSW candidate list size). Raising either trades
+latency for recall.
+
+Vectors can also be stored compressed (config.RAG_VECTOR_STORAGE):
+
+    float32  4 bytes/dim, exact (default)
+    fp16     2 bytes/dim, scalar quantized to float16
+    int8     1 byte/dim, scalar quantized to 8 bits per dimension
+    pq       RAG_PQ_SUBQUANTIZERS bytes/vector, product quantization codes
+
+With config.RAG_EXACT_RESCORE the top k * RAG_RESCORE_FACTOR candidates
+found on the compressed codes are re-scored against full float32 vectors.
+That restores recall, but the float32 copy is kept in memory as well, so it
+only saves memory bandwidth during the scan. Use benchmark_rag_index.py to
+compare memory and recall@k for each mode.
+"""
+
+import json
+import math
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+
+from config import (
+    RAG_EXACT_RESCORE,
+    RAG_FLAT_MAX_CHUNKS,
+    RAG_HNSW_EF_SEARCH,
+    RAG_HNSW_M,
+    RAG_INDEX_RETRAIN_GROWTH,
+    RAG_INDEX_TYPE,
+    RAG_IVF_NPROBE,
+    RAG_PQ_SUBQUANTIZERS,
+    RAG_RECALL_K,
+    RAG_RECALL_QUERIES,
+    RAG_RESCORE_FACTOR,
+    RAG_VECTOR_STORAGE,
+)
+from rag_files import write_json
+
+POLICY_FILE = os.path.join("rag_index", "index_policy.json")
+STORAGE_CODES = {"float32": "Flat", "fp16": "SQfp16", "int8": "SQ8", "pq": f"PQ{RAG_PQ_SUBQUANTIZERS}"}
+# PQ trains 256 centroids per sub-quantizer; faiss wants ~39 points per centroid
+PQ_MIN_TRAINING_POINTS = 256 * 39
+
+
+def index_kind(index) -> str:
+    """Classify a FAISS index as "flat", "ivf" or "hnsw"."""
+    import faiss
+
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexRefine):
+        index = faiss.downcast_index(index.base_index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf"
+    return "flat"
+
+
+def index_storage(index) -> tuple[str, bool]:
+    """Return (storage, rescored) for a FAISS index, e.g. ("int8", True)."""
+    import faiss
+
+    index = faiss.downcast_index(index)
+    rescored = isinstance(index, faiss.IndexRefine)
+    if rescored:
+        index = faiss.downcast_index(index.base_index)
+    if isinstance(index, faiss.IndexHNSW):
+        index = faiss.downcast_index(index.storage)
+    if isinstance(index, (faiss.IndexPQ, faiss.IndexIVFPQ)):
+        return "pq", rescored
+    if isinstance(index, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+        return ("fp16" if index.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "int8"), rescored
+    return "float32", rescored
+
+
+def target_storage(ntotal: int, storage: str = None, rescore: bool = None) -> tuple[str, bool]:
+    """
+    Storage the policy wants for ntotal chunks. PQ needs enough vectors to
+    train its codebooks, so smaller corpora use float16 until then.
+    """
+    storage = storage or RAG_VECTOR_STORAGE
+    if storage not in STORAGE_CODES:
+        raise ValueError(f"Unknown vector storage '{storage}'. Choose one of: {', '.join(STORAGE_CODES)}")
+    if storage == "pq" and ntotal < PQ_MIN_TRAINING_POINTS:
+        storage = "fp16"
+    rescore = RAG_EXACT_RESCORE if rescore is None else rescore
+    return storage, rescore and storage != "float32"
+
+
+def target_kind(ntotal: int, current_kind: str = "flat") -> str:
+    """
+    Index kind the policy wants for ntotal chunks. An approximate index is
+    only turned back into a flat one once the corpus has shrunk well below
+    the threshold, so deletions around the limit don't cause rebuild churn.
+    """
+    if ntotal >= RAG_FLAT_MAX_CHUNKS:
+        return RAG_INDEX_TYPE
+    if current_kind != "flat" and ntotal >= RAG_FLAT_MAX_CHUNKS // 2:
+        return current_kind
+    return "flat"
+
+
+def _ivf_nlist(ntotal: int) -> int:
+    # ~4*sqrt(n) lists, but at least 39 training points per centroid
+    return max(1, min(int(4 * math.sqrt(ntotal)), ntotal // 39))
+
+
+def index_factory_string(kind: str, ntotal: int, storage: str = None, rescore: bool = None) -> str:
+    """faiss.index_factory description for an index of this kind, size and storage."""
+    storage, rescore = target_storage(ntotal, storage, rescore)
+    codes = STORAGE_CODES[storage]
+    if kind == "hnsw":
+        description = f"HNSW{RAG_HNSW_M},{codes}"
+    elif kind == "ivf":
+        description = f"IVF{_ivf_nlist(ntotal)},{codes}"
+    else:
+        description = codes
+    return description + (",RFlat" if rescore else "")
+
+
+def configure_index(index):
+    """
+    Apply the search-time parameters to a built or loaded index. IVF indexes
+    also get a direct map so stored vectors can be read back (deletions,
+    rebuilds and file-restricted search rely on that).
+    """
+    import faiss
+
+    kind = index_kind(index)
+    # downcast_index returns non-owning wrappers; the caller's object is the
+    # one that must be returned
+    inner = faiss.downcast_index(index)
+    if isinstance(inner, faiss.IndexRefine):
+        inner.k_factor = RAG_RESCORE_FACTOR
+        inner = faiss.downcast_index(inner.base_index)
+    params = faiss.ParameterSpace()
+    if kind == "ivf":
+        params.set_index_parameter(inner, "nprobe", RAG_IVF_NPROBE)
+        ivf = faiss.extract_index_ivf(inner)
+        if ivf.direct_map.type == faiss.DirectMap.NoMap:
+            ivf.make_direct_map()
+    elif kind == "hnsw":
+        params.set_index_parameter(inner, "efSearch", RAG_HNSW_EF_SEARCH)
+    return index
+
+
+def build_index(vectors, kind: str, storage: str = None, rescore: bool = None):
+    """Train (if needed) and fill a new index of the given kind and storage."""
+    import faiss
+
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    index = faiss.index_factory(vectors.shape[1], index_factory_string(kind, len(vectors), storage, rescore))
+    if not index.is_trained:
+        index.train(vectors)
+    configure_index(index)
+    index.add(vectors)
+    return index
+
+
+def needs_rebuild(index) -> bool:
+    """
+    True if the index is of the wrong kind or storage for its size, or is an
+    IVF index that has grown RAG_INDEX_RETRAIN_GROWTH times past what it was
+    trained on (its lists would be too long to keep nprobe meaningful).
+    """
+    kind = index_kind(index)
+    if target_kind(index.ntotal, kind) != kind:
+        return True
+    if index_storage(index) != target_storage(index.ntotal):
+        return True
+    if kind == "ivf":
+        trained_on = read_policy_report().get("ntotal") or index.ntotal
+        return index.ntotal >= RAG_INDEX_RETRAIN_GROWTH * trained_on
+    return False
+
+
+def evaluate_recall(index, vectors, k: int = RAG_RECALL_K, num_queries: int = RAG_RECALL_QUERIES) -> dict:
+    """
+    Compare an index against exact search on a held-out query set: a sample
+    of stored chunk vectors, each with its own entry excluded from both result
+    lists so queries never trivially find themselves. Returns recall@k and
+    p50/p99 single-query latency for exact and approximate search.
+    """
+    import faiss
+
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    if len(vectors) < 2:
+        return {"k": k, "queries": 0, "recall_at_k": 1.0}
+    rng = np.random.default_rng(0)
+    sample = rng.choice(len(vectors), size=min(num_queries, len(vectors)), replace=False)
+    fetch = min(k + 1, len(vectors))
+
+    hits = expected = 0
+    exact_ms, approx_ms = [], []
+    for position in sample:
+        query = vectors[position:position + 1]
+        start = time.perf_counter()
+        _, exact = faiss.knn(query, vectors, fetch)
+        exact_ms.append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        _, approx = index.search(query, fetch)
+        approx_ms.append((time.perf_counter() - start) * 1000)
+
+        truth = [i for i in exact[0] if i != position][:k]
+        found = [i for i in approx[0] if i not in (position, -1)][:k]
+        hits += len(set(truth) & set(found))
+        expected += len(truth)
+
+    return {
+        "k": k,
+        "queries": len(sample),
+        "recall_at_k": round(hits / expected, 4) if expected else 1.0,
+        "latency_ms": {
+            "exact_p50": round(float(np.percentile(exact_ms, 50)), 3),
+            "exact_p99": round(float(np.percentile(exact_ms, 99)), 3),
+            "approx_p50": round(float(np.percentile(approx_ms, 50)), 3),
+            "approx_p99": round(float(np.percentile(approx_ms, 99)), 3),
+        },
+    }
+
+
+def describe_index(index, vectors=None) -> dict:
+    """
+    Policy report for an index: its kind, size and search parameters, plus
+    recall/latency against exact search when vectors are given.
+    """
+    kind = index_kind(index)
+    storage, rescored = index_storage(index)
+    report = {
+        "kind": kind,
+        "index_type": index_factory_string(kind, index.ntotal, storage, rescored),
+        "storage": storage,
+        "exact_rescore": rescored,
+        "ntotal": int(index.ntotal),
+        "index_bytes": index_bytes(index),
+        "built_at": datetime.now().isoformat(),
+    }
+    if kind == "ivf":
+        report["nprobe"] = RAG_IVF_NPROBE
+    elif kind == "hnsw":
+        report["efSearch"] = RAG_HNSW_EF_SEARCH
+    if vectors is not None and (kind, storage) != ("flat", "float32"):
+        report.update(evaluate_recall(index, vectors))
+    return report
+
+
+def index_bytes(index) -> int:
+    """Size of the index in memory, measured as its serialized size."""
+    import faiss
+
+    return int(faiss.serialize_index(index).nbytes)
+
+
+def read_policy_report() -> dict:
+    """The report of the last index rebuild ({} if there was none)."""
+    if not os.path.exists(POLICY_FILE):
+        return {}
+    try:
+        with open(POLICY_FILE, 'r') as f:
+            return json.load(f)
+    except:
+        return {}
+
+
+def write_policy_report(report: dict):
+    """Atomically replace the policy report."""
+    write_json(POLICY_FILE, report, indent=2)
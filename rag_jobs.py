@@ -0,0 +1,184 @@
+"""
+Background ingestion jobs for uploaded documents.
+
+Uploads are handed to a small thread pool instead of being parsed, embedded
+and indexed inside the Flask request. Each job records its progress so the
+UI can poll /api/ingest_jobs/<job_id>. Once a document is searchable the
+job is reported done and its summary (see rag_summaries) is queued on a
+separate single worker, so slow multi-call summaries never hold up later
+uploads; summary_status tracks that stage.
+
+Every status change is also written to rag_index/jobs/<job_id>.json, so a
+poll that lands on another worker process still finds the job.
+"""
+
+import json
+import os
+import re
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from config import INGEST_JOB_HISTORY, INGEST_MAX_WORKERS, RAG_BUILD_SUMMARIES
+from rag_files import write_json
+
+JOBS_DIR = os.path.join("rag_index", "jobs")
+
+
+def _job_file(job_id: str) -> str:
+    return os.path.join(JOBS_DIR, f"{job_id}.json")
+
+
+def read_job(job_id: str):
+    """The saved status of a job (possibly run by another process), or None."""
+    if not re.fullmatch(r"[0-9a-f]{32}", job_id):
+        return None
+    try:
+        with open(_job_file(job_id), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class IngestionJob:
+    """Status and progress of one document ingestion."""
+
+    def __init__(self, filename: str):
+        self.job_id = uuid.uuid4().hex
+        self.filename = filename
+        self.status = "queued"  # queued -> running -> success | error
+        self.stage = "queued"
+        self.pages_total = 0
+        self.pages_parsed = 0
+        self.chunks_embedded = 0
+        self.message = ""
+        self.summary_status = "pending" if RAG_BUILD_SUMMARIES else "disabled"  # pending -> running -> ready | skipped | error
+        self.created_at = datetime.now().isoformat()
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def update(self, stage: str, **counts):
+        """Progress callback passed to RAGEngine.process_file."""
+        with self._lock:
+            self.stage = stage
+            for name, value in counts.items():
+                setattr(self, name, value)
+        self.save()
+
+    def finish(self, success: bool, message: str):
+        with self._lock:
+            self.status = "success" if success else "error"
+            self.stage = "done"
+            self.message = message
+            self.finished_at = datetime.now().isoformat()
+        self.save()
+
+    def save(self):
+        """Write the current status for pollers in other processes."""
+        try:
+            write_json(_job_file(self.job_id), self.to_dict())
+        except OSError as e:
+            print(f"Could not save ingestion job {self.job_id}: {e}")
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("success", "error")
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "job_id": self.job_id,
+                "filename": self.filename,
+                "status": self.status,
+                "stage": self.stage,
+                "pages_total": self.pages_total,
+                "pages_parsed": self.pages_parsed,
+                "chunks_embedded": self.chunks_embedded,
+                "message": self.message,
+                "summary_status": self.summary_status,
+                "created_at": self.created_at,
+                "finished_at": self.finished_at,
+            }
+
+
+class IngestionQueue:
+    """Bounded worker pool that runs ingestion jobs against a RAGEngine."""
+
+    def __init__(self, rag_engine, max_workers: int = INGEST_MAX_WORKERS, history: int = INGEST_JOB_HISTORY):
+        self.rag_engine = rag_engine
+        self.history = history
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+        self._summary_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="summarize")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._prune_saved()
+
+    def submit(self, file_path: str, filename: str, content_hash: str = None) -> IngestionJob:
+        """Queue a saved upload for ingestion and return its job immediately."""
+        job = IngestionJob(filename)
+        job.save()
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self._prune()
+        self._executor.submit(self._run, job, file_path, filename, content_hash)
+        return job
+
+    def status(self, job_id: str):
+        """A job's status dict, also for jobs submitted to another worker process."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        return job.to_dict() if job is not None else read_job(job_id)
+
+    def _run(self, job: IngestionJob, file_path: str, filename: str, content_hash: str = None):
+        job.update(job.stage, status="running")
+        try:
+            success, message = self.rag_engine.process_file(
+                file_path, filename, progress=job.update, content_hash=content_hash
+            )
+        except Exception as e:
+            success, message = False, f"Error processing file: {str(e)}"
+        job.finish(success, message)
+        print(f"Ingestion job {job.job_id} ({filename}): {job.status} - {message}")
+        if job.summary_status != "pending":
+            return
+        if success:
+            self._summary_executor.submit(self._summarize, job, filename)
+        else:
+            job.update(job.stage, summary_status="skipped")
+
+    def _summarize(self, job: IngestionJob, filename: str):
+        """
+        Background summary stage; failures never affect the ingested document.
+        Files that already have a summary (re-uploads) are skipped.
+        """
+        job.update(job.stage, summary_status="running")
+        try:
+            built = self.rag_engine.summarize_document(filename)
+            job.update(job.stage, summary_status="ready" if built else "skipped")
+        except Exception as e:
+            job.update(job.stage, summary_status="error")
+            print(f"Summary for {filename} failed: {e}")
+
+    def _prune_saved(self):
+        """Keep only the newest status files (older runs' jobs are never polled again)."""
+        if not os.path.exists(JOBS_DIR):
+            return
+        paths = [os.path.join(JOBS_DIR, name) for name in os.listdir(JOBS_DIR) if name.endswith(".json")]
+        paths.sort(key=os.path.getmtime, reverse=True)
+        for path in paths[self.history:]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _prune(self):
+        """Drop the oldest finished jobs (and their status files) beyond the history limit."""
+        finished = [job_id for job_id, job in self._jobs.items() if job.done]
+        for job_id in finished[:max(0, len(self._jobs) - self.history)]:
+            del self._jobs[job_id]
+            try:
+                os.remove(_job_file(job_id))
+            except OSError:
+                pass
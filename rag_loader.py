@@ -1,33 +1,156 @@
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import PyPDFLoader
+from langchain_core.documents import Document
+from collections import deque
+import multiprocessing
+import threading
 import os
 
-def load_and_split_document(file_path):
+from config import PDF_PAGES_PER_TASK, PDF_PARALLEL_MIN_PAGES, PDF_PARSE_WORKERS, RAG_CHUNK_OVERLAP_TOKENS, RAG_CHUNK_TOKENS
+from rag_embeddings import EMBEDDING_MAX_TOKENS, get_tokenizer
+from rag_pdf_backends import get_pdf_backend
+
+# Used to size chunks when the embedding tokenizer isn't available
+CHARS_PER_TOKEN = 4
+
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+def _get_splitter(chunk_tokens=RAG_CHUNK_TOKENS, overlap_tokens=RAG_CHUNK_OVERLAP_TOKENS):
     """
-    Load a document (PDF or Text) and split it into chunks.
+    Splitter that measures chunks in the embedding model's word-pieces, so
+    no chunk is longer than the model reads (EMBEDDING_MAX_TOKENS minus
+    [CLS]/[SEP]) and every chunk's text is fully embedded. Without the
+    tokenizer, lengths are estimated from characters.
+    """
+    chunk_tokens = min(chunk_tokens, EMBEDDING_MAX_TOKENS - 2)
+    overlap_tokens = min(overlap_tokens, chunk_tokens // 2)
+    tokenizer = get_tokenizer()
+    if tokenizer is not None:
+        return RecursiveCharacterTextSplitter.from_huggingface_tokenizer(
+            tokenizer,
+            chunk_size=chunk_tokens,
+            chunk_overlap=overlap_tokens
+        )
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_tokens * CHARS_PER_TOKEN,
+        chunk_overlap=overlap_tokens * CHARS_PER_TOKEN,
+        length_function=len
+    )
+
+def count_pages(file_path):
+    """
+    Number of pages in a document (text files count as a single page).
+    """
+    if file_path.lower().endswith('.pdf'):
+        return get_pdf_backend().page_count(file_path)
+    return 1
+
+def _get_parse_pool():
+    """
+    Process pool shared by every ingestion in this process, so page ranges
+    from several uploads are spread over the same workers.
+    Uses 'spawn' because forking a threaded Flask/torch process is unsafe.
+    """
+    global _parse_pool
+    if _parse_pool is None:
+        with _parse_pool_lock:
+            if _parse_pool is None:
+                from concurrent.futures import ProcessPoolExecutor
+                _parse_pool = ProcessPoolExecutor(
+                    max_workers=PDF_PARSE_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+    return _parse_pool
+
+def _extract_page_range(file_path, start, stop, backend_name):
+    """
+    Extract the text of pages [start, stop). Runs in a worker process and
+    goes through the same backend as the serial path, so both produce
+    identical chunks.
+    """
+    return get_pdf_backend(backend_name).extract_pages(file_path, start, stop)
+
+def _iter_pdf_texts_parallel(file_path, total_pages, pages_per_task, backend_name):
     """
-    documents = []
-    
+    Yield (page_number, text) in page order while page ranges are parsed
+    across the process pool. Only a few ranges are in flight at a time,
+    which keeps memory bounded for very large PDFs.
+    """
+    pool = _get_parse_pool()
+    ranges = deque(
+        (start, min(start + pages_per_task, total_pages))
+        for start in range(0, total_pages, pages_per_task)
+    )
+    in_flight = deque()
+    while ranges or in_flight:
+        while ranges and len(in_flight) < PDF_PARSE_WORKERS * 2:
+            start, stop = ranges.popleft()
+            in_flight.append((start, pool.submit(_extract_page_range, file_path, start, stop, backend_name)))
+        start, future = in_flight.popleft()
+        for offset, text in enumerate(future.result()):
+            yield start + offset, text
+
+def _iter_pdf_texts(file_path):
+    """
+    Yield (page_number, text) for every page of a PDF, in page order.
+    With PDF_PARSE_WORKERS > 1, extraction runs in the process pool: large
+    PDFs are split into page ranges, smaller ones go to a single worker so
+    several uploads still parse in parallel.
+    """
+    backend = get_pdf_backend()
+    if PDF_PARSE_WORKERS > 1:
+        total_pages = backend.page_count(file_path)
+        if total_pages > 0:
+            pages_per_task = PDF_PAGES_PER_TASK if total_pages >= PDF_PARALLEL_MIN_PAGES else total_pages
+            yield from _iter_pdf_texts_parallel(file_path, total_pages, pages_per_task, backend.name)
+        return
+    yield from enumerate(backend.iter_pages(file_path))
+
+def iter_document_pages(file_path, source=None):
+    """
+    Yield a document one page at a time (PDF) or as a single page (TXT/MD),
+    so callers never hold the whole document in memory.
+    Pages carry the same source/page metadata as PyPDFLoader; pass source to
+    label them with a display name instead of the storage path.
+    """
+    source = source or file_path
     if file_path.lower().endswith('.pdf'):
-        loader = PyPDFLoader(file_path)
-        documents = loader.load()
+        for page_number, text in _iter_pdf_texts(file_path):
+            yield Document(
+                page_content=text,
+                metadata={"source": source, "page": page_number}
+            )
     elif file_path.lower().endswith('.txt') or file_path.lower().endswith('.md'):
-        # For text files, we can just read them and create a generic document-like structure if needed,
-        # but LangChain has TextLoader too. Let's stick to the user's manual reading if preferred, 
-        # or use TextLoader for consistency. Let's use a simple approach for text files to match the previous robustness.
-        # However, to be consistent with PyPDFLoader returning 'Document' objects, we should mimic that.
-        from langchain_core.documents import Document
         with open(file_path, 'r', encoding='utf-8') as f:
             text = f.read()
-        documents = [Document(page_content=text, metadata={"source": file_path})]
+        yield Document(page_content=text, metadata={"source": source})
     else:
         raise ValueError("Unsupported file format. Please upload PDF, TXT, or MD.")
 
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=200,
-        length_function=len
-    )
+def iter_chunks(file_path, source=None, splitter=None):
+    """
+    Split a document into chunks page by page as the pages are read.
+    """
+    splitter = splitter or _get_splitter()
+    for page in iter_document_pages(file_path, source):
+        # Pages are split independently, exactly like split_documents does
+        yield from splitter.split_documents([page])
+
+def iter_chunk_batches(file_path, batch_size, source=None):
+    """
+    Yield lists of at most batch_size chunks, reading pages lazily.
+    """
+    batch = []
+    for chunk in iter_chunks(file_path, source):
+        batch.append(chunk)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
-    chunks = splitter.split_documents(documents)
-    return chunks
+def load_and_split_document(file_path):
+    """
+    Load a document (PDF or Text) and split it into chunks.
+    """
+    return list(iter_chunks(file_path))
@@ -0,0 +1,132 @@
+"""
+PDF text-extraction backends for the RAG loader.
+
+pypdf is the default (pure Python, always installed). Faster native
+extractors can be selected with config.PDF_EXTRACTION_BACKEND once their
+package is installed:
+
+    pymupdf    pip install pymupdf
+    pypdfium2  pip install pypdfium2
+
+Use benchmark_pdf_backends.py to compare speed and text parity on your own
+documents before switching.
+"""
+
+from config import PDF_EXTRACTION_BACKEND
+
+
+class PDFBackend:
+    """Interface every extraction backend implements."""
+
+    name = None
+    package = None
+
+    def is_available(self) -> bool:
+        """True if the backend's package can be imported."""
+        try:
+            self._import()
+            return True
+        except ImportError:
+            return False
+
+    def page_count(self, file_path: str) -> int:
+        raise NotImplementedError
+
+    def iter_pages(self, file_path: str, start: int = 0, stop: int = None):
+        """Yield the text of pages [start, stop) in order, opening the file once."""
+        raise NotImplementedError
+
+    def extract_pages(self, file_path: str, start: int, stop: int) -> list:
+        return list(self.iter_pages(file_path, start, stop))
+
+    def _import(self):
+        raise NotImplementedError
+
+
+class PyPDFBackend(PDFBackend):
+    """Pure-Python extraction; matches what PyPDFLoader produced."""
+
+    name = "pypdf"
+    package = "pypdf"
+
+    def _import(self):
+        from pypdf import PdfReader
+        return PdfReader
+
+    def page_count(self, file_path):
+        return len(self._import()(file_path).pages)
+
+    def iter_pages(self, file_path, start=0, stop=None):
+        reader = self._import()(file_path)
+        stop = len(reader.pages) if stop is None else stop
+        for page_number in range(start, stop):
+            yield reader.pages[page_number].extract_text()
+
+
+class PyMuPDFBackend(PDFBackend):
+    """MuPDF (C) extraction through PyMuPDF."""
+
+    name = "pymupdf"
+    package = "pymupdf"
+
+    def _import(self):
+        import pymupdf
+        return pymupdf
+
+    def page_count(self, file_path):
+        with self._import().open(file_path) as doc:
+            return doc.page_count
+
+    def iter_pages(self, file_path, start=0, stop=None):
+        with self._import().open(file_path) as doc:
+            stop = doc.page_count if stop is None else stop
+            for page_number in range(start, stop):
+                yield doc[page_number].get_text("text")
+
+
+class PdfiumBackend(PDFBackend):
+    """PDFium (Chrome's PDF engine) extraction through pypdfium2."""
+
+    name = "pypdfium2"
+    package = "pypdfium2"
+
+    def _import(self):
+        import pypdfium2
+        return pypdfium2
+
+    def page_count(self, file_path):
+        doc = self._import().PdfDocument(file_path)
+        try:
+            return len(doc)
+        finally:
+            doc.close()
+
+    def iter_pages(self, file_path, start=0, stop=None):
+        doc = self._import().PdfDocument(file_path)
+        try:
+            stop = len(doc) if stop is None else stop
+            for page_number in range(start, stop):
+                page = doc[page_number]
+                textpage = page.get_textpage()
+                # PDFium uses CRLF line breaks; normalize to match the others
+                yield textpage.get_text_range().replace("\r\n", "\n")
+                textpage.close()
+                page.close()
+        finally:
+            doc.close()
+
+
+PDF_BACKENDS = {backend.name: backend for backend in (PyPDFBackend, PyMuPDFBackend, PdfiumBackend)}
+
+
+def get_pdf_backend(name: str = None) -> PDFBackend:
+    """
+    Return the configured extraction backend (config.PDF_EXTRACTION_BACKEND).
+    """
+    name = name or PDF_EXTRACTION_BACKEND
+    if name not in PDF_BACKENDS:
+        raise ValueError(f"Unknown PDF extraction backend '{name}'. Choose one of: {', '.join(PDF_BACKENDS)}")
+    backend = PDF_BACKENDS[name]()
+    if not backend.is_available():
+        raise ValueError(f"PDF extraction backend '{name}' needs the '{backend.package}' package (pip install {backend.package})")
+    return backend
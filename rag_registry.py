@@ -0,0 +1,55 @@
+"""
+Process-wide registry for the live RAG index.
+
+Readers take an immutable snapshot (vector store + filename index + version)
+and use it for the whole request, so an upload finishing mid-request never
+changes what they see. Writers serialize on write_lock, build the next index
+on a copy, and publish it with a single reference swap.
+"""
+
+import threading
+from typing import Any, NamedTuple
+
+
+class IndexSnapshot(NamedTuple):
+    """A consistent view of the knowledge base at one version."""
+    vector_store: Any
+    source_index: dict      # filename -> docstore ids
+    source_positions: dict  # filename -> FAISS positions
+    version: int
+
+
+class IndexRegistry:
+    """Holds the current IndexSnapshot and hands out new versions."""
+
+    def __init__(self):
+        self.write_lock = threading.RLock()
+        self._swap_lock = threading.Lock()
+        self._snapshot = IndexSnapshot(None, {}, {}, 0)
+        self.loaded = False
+        # rag_vectorstore.index_generation() the published index was loaded
+        # or written at (read-write mode), to notice other processes' writes
+        self.generation = None
+
+    def snapshot(self) -> IndexSnapshot:
+        """Return the current snapshot. Never blocks on writers."""
+        return self._snapshot
+
+    @property
+    def version(self) -> int:
+        return self._snapshot.version
+
+    def publish(self, vector_store, source_index: dict, source_positions: dict) -> IndexSnapshot:
+        """
+        Atomically swap in a new index and bump the version.
+        Callers must not mutate the published objects afterwards.
+        """
+        with self._swap_lock:
+            snapshot = IndexSnapshot(vector_store, source_index, source_positions, self._snapshot.version + 1)
+            self._snapshot = snapshot
+            self.loaded = True
+        return snapshot
+
+
+# The single registry shared by every RAGEngine in this process
+index_registry = IndexRegistry()
@@ -0,0 +1,149 @@
+"""
+Relevance threshold for RAG context.
+
+Untagged retrieval only puts a chunk into the prompt when its cosine
+similarity to the query clears the relevance threshold and is within
+config.RAG_RELEVANCE_DROP of the best chunk (adaptive k: a query with one
+strong match gets one chunk, not k). When nothing clears the bar the context
+block is left out of the prompt entirely, so turns like "yes, continue"
+don't carry unrelated document text.
+
+The threshold is calibrated per knowledge base with calibrate_relevance.py:
+
+    on-topic   sentences taken from random chunks, scored against their chunk
+    off-topic  conversational turns (quick actions, "yes, continue", ...),
+               scored against their best match in the index
+
+The threshold rejects 95% of off-topic turns, capped at the 10th percentile
+of on-topic scores so real questions keep their context. It is written to
+rag_index/relevance.json; until then config.RAG_MIN_RELEVANCE is used.
+"""
+
+import json
+import os
+import re
+from datetime import datetime
+
+import numpy as np
+
+from config import QUICK_ACTIONS, RAG_MIN_RELEVANCE, RAG_RECALL_QUERIES, RAG_RELEVANCE_DROP
+from rag_files import write_json
+
+RELEVANCE_FILE = os.path.join("rag_index", "relevance.json")
+
+OFF_TOPIC_QUERIES = [
+    "yes", "yes, continue", "ok", "okay, go on", "next", "continue", "thanks!", "thank you",
+    "hello", "hi there", "I don't understand", "can you repeat that?", "what should we learn next?",
+    "sounds good", "no", "let's move on",
+] + [action["prompt"] for action in QUICK_ACTIONS]
+
+_cached = (None, RAG_MIN_RELEVANCE)
+
+
+def relevance_threshold() -> float:
+    """The calibrated threshold, or config.RAG_MIN_RELEVANCE. Re-read when the file changes."""
+    global _cached
+    try:
+        mtime = os.path.getmtime(RELEVANCE_FILE)
+    except OSError:
+        return RAG_MIN_RELEVANCE
+    if _cached[0] != mtime:
+        try:
+            with open(RELEVANCE_FILE, 'r') as f:
+                _cached = (mtime, float(json.load(f)["threshold"]))
+        except:
+            _cached = (mtime, RAG_MIN_RELEVANCE)
+    return _cached[1]
+
+
+def relevant(similarity, threshold: float = None):
+    """Boolean mask of the candidates that clear the threshold and the adaptive-k margin."""
+    similarity = np.asarray(similarity)
+    if len(similarity) == 0:
+        return similarity.astype(bool)
+    threshold = relevance_threshold() if threshold is None else threshold
+    return similarity >= max(threshold, float(similarity.max()) - RAG_RELEVANCE_DROP)
+
+
+def _cosine(a, b):
+    a = np.asarray(a, dtype=np.float32)
+    b = np.asarray(b, dtype=np.float32)
+    return (a * b).sum(axis=1) / np.maximum(np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1), 1e-12)
+
+
+def _probe_queries(vector_store, count: int, seed: int = 0) -> list:
+    """(sentence, position) pairs: one sentence of 6+ words from each of count random chunks."""
+    rng = np.random.default_rng(seed)
+    ntotal = vector_store.index.ntotal
+    probes = []
+    for position in rng.choice(ntotal, size=min(count, ntotal), replace=False):
+        doc = vector_store.docstore.search(vector_store.index_to_docstore_id[int(position)])
+        if isinstance(doc, str):
+            continue
+        sentences = [s for s in re.split(r"(?<=[.!?])\s+", doc.page_content) if len(s.split()) >= 6]
+        text = sentences[rng.integers(len(sentences))] if sentences else " ".join(doc.page_content.split()[:15])
+        if text.strip():
+            probes.append((text, int(position)))
+    return probes
+
+
+def exact_term_probes(vector_store, count: int, seed: int = 0) -> list:
+    """
+    One rare term (an identifier, a name) from each of count random chunks,
+    for checking that hybrid retrieval still finds exact terms past the
+    threshold. Empty unless the chunks live in a ChunkStore.
+    """
+    from config import RAG_RARE_TERM_FRACTION
+    from rag_chunkstore import ChunkStoreDocstore
+
+    if not isinstance(vector_store.docstore, ChunkStoreDocstore):
+        return []
+    store = vector_store.docstore.store
+    max_chunks = max(5, int(RAG_RARE_TERM_FRACTION * vector_store.index.ntotal))
+    terms = []
+    for _, position in _probe_queries(vector_store, count, seed):
+        doc = vector_store.docstore.search(vector_store.index_to_docstore_id[position])
+        rare = [term for term in store.rare_terms(doc.page_content, max_chunks) if len(term) >= 4 and not term.isdigit()]
+        if rare:
+            terms.append(rare[0])
+    return terms
+
+
+def calibrate(vector_store, embeddings, num_queries: int = RAG_RECALL_QUERIES) -> dict:
+    """Measure on-topic and off-topic similarities and pick the threshold."""
+    from rag_vectorstore import search_many
+
+    probes = _probe_queries(vector_store, num_queries)
+    if not probes:
+        raise ValueError("The knowledge base has no chunks to calibrate on")
+    on_vectors = np.array(embeddings.embed_documents([text for text, _ in probes]), dtype=np.float32)
+    chunk_vectors = vector_store.index.reconstruct_batch(np.array([pos for _, pos in probes], dtype=np.int64))
+    on_topic = _cosine(on_vectors, chunk_vectors)
+
+    off_vectors = np.array(embeddings.embed_documents(OFF_TOPIC_QUERIES), dtype=np.float32)
+    best = np.array([positions[0] for positions, _ in search_many(vector_store, off_vectors, 1)], dtype=np.int64)
+    off_topic = _cosine(off_vectors, vector_store.index.reconstruct_batch(best))
+
+    threshold = min(float(np.percentile(off_topic, 95)), float(np.percentile(on_topic, 10)))
+    return {
+        "threshold": round(threshold, 4),
+        "on_topic": {
+            "queries": len(on_topic),
+            "p10": round(float(np.percentile(on_topic, 10)), 4),
+            "p50": round(float(np.percentile(on_topic, 50)), 4),
+            "kept": round(float((on_topic >= threshold).mean()), 4),
+        },
+        "off_topic": {
+            "queries": len(off_topic),
+            "p50": round(float(np.percentile(off_topic, 50)), 4),
+            "p95": round(float(np.percentile(off_topic, 95)), 4),
+            "dropped": round(float((off_topic < threshold).mean()), 4),
+        },
+        "ntotal": int(vector_store.index.ntotal),
+        "calibrated_at": datetime.now().isoformat(),
+    }
+
+
+def write_relevance_report(report: dict):
+    """Atomically replace the calibration report."""
+    write_json(RELEVANCE_FILE, report, indent=2)
@@ -1,10 +1,33 @@
-def retrieve_context(query, vectorstore, k=3):
+"""
+Retrieval modes for RAGEngine.
+
+"dense" ranks chunks by embedding similarity only. "hybrid" also runs a BM25
+search over the chunk store's inverted index and fuses both rankings with
+reciprocal_rank_scores, so exact terms (formula names, code identifiers) are
+found without raising k. RAGEngine._assemble_context runs both.
+"""
+
+from config import RAG_RETRIEVAL_MODE, RAG_RRF_K
+
+RETRIEVAL_MODES = ("dense", "hybrid")
+
+
+def check_mode(mode):
+    """Resolve a retrieval mode, falling back to the configured default."""
+    mode = mode or RAG_RETRIEVAL_MODE
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Unknown retrieval mode '{mode}'. Choose one of: {', '.join(RETRIEVAL_MODES)}")
+    return mode
+
+
+def reciprocal_rank_scores(rankings, k=RAG_RRF_K):
     """
-    Retrieve relevant context chunks for a given query.
+    Reciprocal rank fusion: each item scores sum(1 / (k + rank)) over the
+    rankings it appears in. Only ranks are used, so BM25 and L2 scores never
+    need to be put on the same scale. Returns item -> fused score.
     """
-    if vectorstore is None:
-        return ""
-        
-    docs = vectorstore.similarity_search(query, k=k)
-    context = "\n\n".join([doc.page_content for doc in docs])
-    return context
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return scores
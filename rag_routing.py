@@ -0,0 +1,109 @@
+"""
+File-level routing for knowledge bases with many documents.
+
+At ingest each file gets up to RAG_ROUTING_VECTORS representative vectors:
+k-means centroids of its normalized chunk embeddings (a single centroid for
+short files). They are kept in rag_index/file_vectors.npz next to
+documents_metadata.json and updated together with it.
+
+Once the knowledge base has RAG_ROUTING_MIN_FILES files, untagged queries
+are routed first: each file is scored by its best representative, and only
+the chunks of the RAG_ROUTING_FAN_OUT best files are searched. That keeps
+unrelated sources out of the top-k and the search cost proportional to the
+fan-out rather than to the corpus. Files without vectors (indexed before
+routing existed and not yet backfilled) are always searched.
+"""
+
+import os
+
+import numpy as np
+
+from config import RAG_ROUTING_FAN_OUT, RAG_ROUTING_MIN_FILES, RAG_ROUTING_VECTORS
+from rag_context import normalize_rows
+
+FILE_VECTORS_FILE = os.path.join("rag_index", "file_vectors.npz")
+
+
+def file_vectors(vectors, count: int = RAG_ROUTING_VECTORS, iterations: int = 10) -> np.ndarray:
+    """
+    Representative vectors of one file's chunk embeddings: up to count
+    k-means centroids, seeded with farthest-point picks so the result is
+    deterministic.
+    """
+    vectors = normalize_rows(vectors)
+    count = max(1, min(count, len(vectors) // 8 or 1))
+    centroid = vectors.mean(axis=0, keepdims=True)
+    if count == 1:
+        return normalize_rows(centroid)
+
+    seeds = [int(np.argmin(vectors @ centroid[0]))]
+    while len(seeds) < count:
+        nearest = (vectors @ vectors[seeds].T).max(axis=1)
+        seeds.append(int(np.argmin(nearest)))
+    centers = vectors[seeds]
+    for _ in range(iterations):
+        assignment = (vectors @ centers.T).argmax(axis=1)
+        centers = np.stack([
+            vectors[assignment == i].mean(axis=0) if (assignment == i).any() else centers[i]
+            for i in range(count)
+        ])
+        centers = normalize_rows(centers)
+    return centers
+
+
+def read_file_vectors() -> dict:
+    """filename -> representative vectors, as saved by write_file_vectors."""
+    if not os.path.exists(FILE_VECTORS_FILE):
+        return {}
+    try:
+        with np.load(FILE_VECTORS_FILE) as data:
+            names, owners, vectors = list(data["names"]), data["owners"], data["vectors"]
+    except Exception as e:
+        print(f"Error loading file routing vectors: {e}")
+        return {}
+    return {str(name): vectors[owners == i] for i, name in enumerate(names)}
+
+
+def write_file_vectors(vectors_by_file: dict):
+    """Atomically replace the saved routing vectors."""
+    os.makedirs(os.path.dirname(FILE_VECTORS_FILE), exist_ok=True)
+    names = list(vectors_by_file)
+    if names:
+        owners = np.concatenate([np.full(len(vectors_by_file[name]), i) for i, name in enumerate(names)])
+        vectors = np.concatenate([vectors_by_file[name] for name in names]).astype(np.float32)
+    else:
+        owners, vectors = np.zeros(0, dtype=np.int64), np.zeros((0, 0), dtype=np.float32)
+    tmp_path = FILE_VECTORS_FILE + ".tmp.npz"
+    np.savez(tmp_path, names=np.array(names, dtype=str), owners=owners, vectors=vectors)
+    os.replace(tmp_path, FILE_VECTORS_FILE)
+
+
+def clear_file_vectors():
+    if os.path.exists(FILE_VECTORS_FILE):
+        os.remove(FILE_VECTORS_FILE)
+
+
+class FileRouter:
+    """Picks the files worth searching for a query embedding."""
+
+    def __init__(self, filenames, vectors_by_file: dict):
+        self.filenames = list(filenames)
+        routed = [name for name in self.filenames if name in vectors_by_file]
+        self.unrouted = [name for name in self.filenames if name not in vectors_by_file]
+        self.routed = routed
+        if routed:
+            self.owners = np.concatenate([np.full(len(vectors_by_file[name]), i) for i, name in enumerate(routed)])
+            self.vectors = normalize_rows(np.concatenate([vectors_by_file[name] for name in routed]))
+
+    @property
+    def active(self) -> bool:
+        """Routing only pays off once there are enough files to leave some out."""
+        return len(self.filenames) >= RAG_ROUTING_MIN_FILES and len(self.routed) > RAG_ROUTING_FAN_OUT
+
+    def route(self, query_embedding, fan_out: int = RAG_ROUTING_FAN_OUT) -> list:
+        """The fan_out best-matching files, plus any files that have no vectors."""
+        similarity = self.vectors @ normalize_rows([query_embedding])[0]
+        best = np.full(len(self.routed), -np.inf, dtype=np.float32)
+        np.maximum.at(best, self.owners, similarity)
+        top = np.argsort(-best)[:fan_out]
+        return [self.routed[i] for i in top] + self.unrouted
@@ -0,0 +1,159 @@
+"""
+Hierarchical per-document summaries.
+
+After a document is ingested, its chunks are summarized bottom-up in the
+background (see rag_jobs):
+
+    chunks          packed into groups of RAG_SUMMARY_GROUP_TOKENS
+    group summaries packed and summarized again, level by level ...
+    sections        the last level with more than one summary
+    file summary    the single summary at the top
+
+The results are kept in rag_index/summaries.json (filename -> summary), next
+to documents_metadata.json rather than inside it, so the document list the
+API returns stays small. When a student tags a file and asks for an overview
+of the whole of it ("tell me about this", "summarize", "key points"),
+message_stream answers from the stored summary instead of running retrieval
+over the file's chunks.
+"""
+
+import json
+import os
+import re
+from datetime import datetime
+
+from config import RAG_SUMMARY_GROUP_TOKENS, RAG_SUMMARY_MAX_TOKENS
+from prompt_packer import count_tokens
+from rag_files import write_json
+
+SUMMARIES_FILE = os.path.join("rag_index", "summaries.json")
+
+# The tagged files as a whole ("this", "the document", "@notes.pdf"), not a part of them
+_WHOLE = r"(this|these|it|them|@\S+|(this|these|the)( whole| entire)? (file|document|pdf|paper|text|notes?)s?( @\S+)?)"
+
+SUMMARY_REQUEST = re.compile(
+    r"(please |can you |could you )?("
+    r"(give me |what are |what's |what is )?(an? |the )?"
+    r"(summar\w*|overview|tl;?dr|gist|key (points|ideas|takeaways)|main (points|ideas|topics))"
+    rf"( (of|for|in))?( {_WHOLE})?"
+    rf"|tell me about {_WHOLE}"
+    rf"|what('s| is| are) {_WHOLE} about"
+    rf"|what does {_WHOLE} (cover|say|contain)"
+    r")( please)?",
+    re.IGNORECASE
+)
+
+
+def is_summary_request(message: str) -> bool:
+    """
+    Whether a message asks for an overview of the tagged files as a whole.
+    Questions about a part of them ("summarize section 3") go to retrieval.
+    """
+    return bool(SUMMARY_REQUEST.fullmatch(message.strip().rstrip("?.! ")))
+
+
+def llm_summarize(prompt: str) -> str:
+    """Run one summarization prompt through the configured LLM provider."""
+    from LLM_api import client, DEFAULT_MODEL
+
+    completion = client.chat.completions.create(
+        model=DEFAULT_MODEL,
+        messages=[{"role": "user", "content": prompt}],
+        max_tokens=RAG_SUMMARY_MAX_TOKENS,
+        temperature=0.2
+    )
+    return completion.choices[0].message.content.strip()
+
+
+def _groups(texts: list, budget: int) -> list:
+    """Consecutive texts packed into groups of at most budget tokens (a longer text is a group of its own)."""
+    groups, current, used = [], [], 0
+    for text in texts:
+        tokens = count_tokens(text)
+        if current and used + tokens > budget:
+            groups.append(current)
+            current, used = [], 0
+        current.append(text)
+        used += tokens
+    if current:
+        groups.append(current)
+    return groups
+
+
+def _prompt(filename: str, texts: list, level: int) -> str:
+    words = RAG_SUMMARY_MAX_TOKENS * 3 // 4
+    if level == 0:
+        task = f"Summarize this excerpt from the document \"{filename}\" in at most {words} words."
+    else:
+        task = f"Combine these partial summaries of the document \"{filename}\" (in document order) into one summary of at most {words} words."
+    body = "\n\n---\n\n".join(texts)
+    return f"""{task}
+Keep the key concepts, definitions and facts, in the order the document presents them.
+Use only information from the text below. Return only the summary.
+
+{body}"""
+
+
+def build_summary(filename: str, chunks: list, summarize=llm_summarize, group_tokens: int = RAG_SUMMARY_GROUP_TOKENS) -> dict:
+    """
+    Summarize a document's chunks (in document order) level by level.
+    Returns {"text", "sections", "levels", "llm_calls", "created_at"}.
+    """
+    level, texts, sections, calls = 0, list(chunks), [], 0
+    while True:
+        groups = _groups(texts, group_tokens)
+        if level > 0 and len(groups) == len(texts) > 1:
+            # Summaries too long to pack together; merge them in one call rather than loop
+            groups = [texts]
+        texts = [summarize(_prompt(filename, group, level)) for group in groups]
+        calls += len(texts)
+        level += 1
+        if len(texts) == 1:
+            break
+        sections = texts
+    return {
+        "text": texts[0],
+        "sections": sections,
+        "levels": level,
+        "llm_calls": calls,
+        "created_at": datetime.now().isoformat(),
+    }
+
+
+def read_summaries() -> dict:
+    """filename -> stored summary, as saved by write_summaries."""
+    if not os.path.exists(SUMMARIES_FILE):
+        return {}
+    try:
+        with open(SUMMARIES_FILE, 'r') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"Error loading document summaries: {e}")
+        return {}
+
+
+def write_summaries(summaries: dict):
+    """Atomically replace the saved summaries."""
+    write_json(SUMMARIES_FILE, summaries, indent=2)
+
+
+def clear_summaries():
+    if os.path.exists(SUMMARIES_FILE):
+        os.remove(SUMMARIES_FILE)
+
+
+def format_summaries(summaries: dict) -> str:
+    """Context block for the tutoring prompt from filename -> stored summary."""
+    parts = []
+    for filename, summary in summaries.items():
+        part = f"[{filename}]\n{summary['text']}"
+        if summary.get("sections"):
+            part += "\n\nSection by section:\n" + "\n".join(f"- {section}" for section in summary["sections"])
+        parts.append(part)
+    body = "\n\n---\n\n".join(parts)
+    return f"""SUMMARIES OF REFERENCED DOCUMENTS ({', '.join(summaries)}):
+---
+{body}
+---
+
+The summaries above were generated from the full documents. Answer from them and do not add facts they don't contain."""
@@ -1,41 +1,568 @@
 from langchain_community.vectorstores import FAISS
+import numpy as np
+import json
 import os
+import shutil
+import threading
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, run a single read-write process
+    fcntl = None
+
+from config import RAG_COMPACTION_SEGMENTS, RAG_EMBED_BATCH_SIZE
+from rag_index_policy import build_index, configure_index, index_kind, target_kind
+from rag_chunkstore import CHUNK_STORE_PATH, ChunkIdMap, ChunkStoreDocstore, get_chunk_store
+from rag_files import write_json
 
 INDEX_PATH = "rag_index"
+SEGMENTS_DIR = os.path.join(INDEX_PATH, "segments")
+STATE_FILE = os.path.join(INDEX_PATH, "index_state.json")
+LOCK_FILE = os.path.join(INDEX_PATH, ".lock")
+
+# The on-disk index is a compacted base plus append-only delta segments:
+#
+#   rag_index/index_state.json      {"base": "base-000004", "compacted_through": 4}
+#   rag_index/base-000004/          full index as of segment 4
+#   rag_index/segments/seg-000005/  vectors added after the last compaction
+#
+#   rag_index/chunks.db             chunk text + per-directory positions
+#
+# Uploads only write a new segment. Compaction folds the segments into a new
+# base directory and then flips index_state.json, so a crash at any point
+# leaves a consistent index behind. Directories hold only index.faiss; their
+# position -> chunk id maps are in chunks.db (see rag_chunkstore).
+#
+# Several read-write processes (gunicorn workers, the debug reloader) may
+# share rag_index. Every write holds index_lock, and a writer first reloads
+# the index if index_generation() shows another process wrote since it last
+# loaded, so segment numbers never collide and compaction never drops
+# segments it hasn't seen.
+
+
+class _IndexLock:
+    """
+    Exclusive cross-process lock on rag_index (fcntl.flock on
+    rag_index/.lock). Reentrant within a process, so nested writes don't
+    deadlock on their own lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+
+    def __enter__(self):
+        self._lock.acquire()
+        if self._depth == 0:
+            os.makedirs(INDEX_PATH, exist_ok=True)
+            self._file = open(LOCK_FILE, 'a')
+            if fcntl is not None:
+                fcntl.flock(self._file, fcntl.LOCK_EX)
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0:
+            if fcntl is not None:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+        self._lock.release()
+
+
+index_lock = _IndexLock()
+
+
+def index_generation():
+    """
+    What the on-disk index consists of: (base, live segment names). Any
+    process writing a segment or compacting changes it.
+    """
+    state = _read_state()
+    return state["base"], tuple(_list_segments(state["compacted_through"]))
 
-def create_vector_store(chunks, embeddings):
+
+def _read_state():
     """
-    Create a new vector store from document chunks and save it locally.
-    If an index already exists, this will load it and add to it.
+    Read the compaction state, falling back to the legacy single-file layout.
     """
-    if os.path.exists(INDEX_PATH):
+    if os.path.exists(STATE_FILE):
         try:
-            vectorstore = FAISS.load_local(INDEX_PATH, embeddings, allow_dangerous_deserialization=True)
-            vectorstore.add_documents(chunks)
+            with open(STATE_FILE, 'r') as f:
+                return json.load(f)
         except:
-            # If load fails, start fresh
-            vectorstore = FAISS.from_documents(chunks, embeddings)
+            pass
+    if os.path.exists(os.path.join(INDEX_PATH, "index.faiss")):
+        # Index written by an older version directly into rag_index/
+        return {"base": ".", "compacted_through": 0}
+    return {"base": None, "compacted_through": 0}
+
+
+def _write_state(state):
+    """
+    Atomically replace the compaction state file.
+    """
+    write_json(STATE_FILE, state)
+
+
+def _segment_number(name):
+    return int(name.split("-")[1])
+
+
+def _list_segments(compacted_through=0):
+    """
+    Return the names of live segments (newer than the last compaction) in order.
+    """
+    if not os.path.exists(SEGMENTS_DIR):
+        return []
+    names = [n for n in os.listdir(SEGMENTS_DIR) if n.startswith("seg-")]
+    names = [n for n in names if _segment_number(n) > compacted_through]
+    return sorted(names, key=_segment_number)
+
+
+def _save_segment(segment):
+    """
+    Persist a delta vector store as the next segment (under index_lock).
+    The segment is written to a temp directory first so a half-written
+    segment is never picked up by load_vector_store.
+    """
+    state = _read_state()
+    existing = _list_segments()
+    last = max([_segment_number(n) for n in existing] + [state["compacted_through"]])
+    name = f"seg-{last + 1:06d}"
+
+    # Chunks first: a segment directory must never point at missing chunks
+    # (a PendingSegment has stored them already)
+    if not isinstance(segment.docstore, ChunkStoreDocstore):
+        get_chunk_store().add({
+            doc_id: segment.docstore.search(doc_id) for doc_id in segment.index_to_docstore_id.values()
+        })
+    os.makedirs(SEGMENTS_DIR, exist_ok=True)
+    tmp_path = os.path.join(SEGMENTS_DIR, f".tmp-{name}")
+    _write_index_dir(tmp_path, name, segment)
+    os.replace(tmp_path, os.path.join(SEGMENTS_DIR, name))
+    return name
+
+
+def _write_index_dir(path, name, vectorstore):
+    """
+    Save a vector store's FAISS index to path and its position -> chunk id
+    map to the chunk store under name. Chunks must already be stored.
+    """
+    import faiss
+
+    os.makedirs(path, exist_ok=True)
+    faiss.write_index(vectorstore.index, os.path.join(path, "index.faiss"))
+    ids = vectorstore.index_to_docstore_id
+    get_chunk_store().write_positions(name, [ids[position] for position in range(len(ids))])
+
+
+def _read_index_dir(path, name, embeddings, store, migrate=True):
+    """
+    Load an index directory on top of the chunk store. Directories written
+    before the chunk store existed (index.pkl) are migrated once: their
+    pickled chunks are copied into chunks.db and index.pkl is removed.
+    """
+    import faiss
+
+    pickle_path = os.path.join(path, "index.pkl")
+    if os.path.exists(pickle_path) and not store.has_positions(name):
+        legacy = FAISS.load_local(path, embeddings, allow_dangerous_deserialization=True)
+        if not migrate:
+            return legacy
+        store.add(legacy.docstore._dict, legacy=True)
+        ids = legacy.index_to_docstore_id
+        store.write_positions(name, [ids[position] for position in range(len(ids))])
+        os.remove(pickle_path)
+
+    index = configure_index(faiss.read_index(os.path.join(path, "index.faiss")))
+    return FAISS(embeddings, index, ChunkStoreDocstore(store), store.read_positions(name))
+
+
+class PendingSegment:
+    """
+    An upload being embedded. Each batch's chunks go straight to the chunk
+    store and its vectors to a temp file under segments/, so memory use
+    while a document is parsed and embedded depends on the batch size, not
+    on the document. The chunk rows stay invisible to search until
+    commit_segment writes their positions.
+    """
+
+    def __init__(self):
+        os.makedirs(SEGMENTS_DIR, exist_ok=True)
+        self.path = os.path.join(SEGMENTS_DIR, f".pending-{uuid.uuid4().hex}.f32")
+        self._file = open(self.path, 'wb')
+        self.store = get_chunk_store()
+        self.ids = []
+        self.dimension = None
+
+    def add(self, chunks, vectors, ids):
+        """Store one batch of embedded chunks."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        self.store.add(dict(zip(ids, chunks)))
+        self._file.write(vectors.tobytes())
+        self.dimension = vectors.shape[1]
+        self.ids.extend(ids)
+
+    def vectors(self):
+        """All vectors written so far, memory-mapped from the temp file."""
+        self._file.flush()
+        return np.memmap(self.path, dtype=np.float32, mode='r', shape=(len(self.ids), self.dimension))
+
+    def to_segment(self, embeddings, batch_size=RAG_EMBED_BATCH_SIZE):
+        """A flat segment over the stored chunks, ready for commit_segment."""
+        import faiss
+
+        if get_chunk_store() is not self.store:
+            raise RuntimeError("The knowledge base was cleared while this file was being embedded")
+        index = faiss.IndexFlatL2(self.dimension)
+        vectors = self.vectors()
+        for start in range(0, len(self.ids), batch_size):
+            index.add(np.ascontiguousarray(vectors[start:start + batch_size]))
+        return FAISS(embeddings, index, ChunkStoreDocstore(self.store), dict(enumerate(self.ids)))
+
+    def close(self, discard=False):
+        """Remove the temp file, and with discard the chunk rows as well."""
+        self._file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        if discard and self.ids:
+            self.store.delete(self.ids)
+
+
+def add_to_segment(segment, chunks, vectors, ids, embeddings):
+    """
+    Add one batch of embedded chunks to a pending segment (created on the
+    first batch). A segment is a small standalone vector store holding only
+    the vectors of one ingestion.
+    """
+    text_embeddings = list(zip([chunk.page_content for chunk in chunks], vectors))
+    metadatas = [chunk.metadata for chunk in chunks]
+    if segment is None:
+        return FAISS.from_embeddings(text_embeddings, embeddings, metadatas=metadatas, ids=ids)
+    segment.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+    return segment
+
+
+def commit_segment(vectorstore, segment):
+    """
+    Merge a finished segment into the live vector store and persist it as
+    the next delta segment. Returns the updated vector store.
+    """
+    _save_segment(segment)
+    vectorstore = _merge_stored_segment(vectorstore, segment)
+
+    if len(_list_segments(_read_state()["compacted_through"])) >= RAG_COMPACTION_SEGMENTS:
+        compact_vector_store(vectorstore)
+
+    return vectorstore
+
+
+def merge_segment(vectorstore, segment):
+    """
+    Store a segment's chunks and merge its vectors into the vector store in
+    memory, without writing a delta segment. For bulk loads, where the
+    caller writes the result once with compact_vector_store(force=True).
+    Returns the updated vector store.
+    """
+    get_chunk_store().add({
+        doc_id: segment.docstore.search(doc_id) for doc_id in segment.index_to_docstore_id.values()
+    })
+    return _merge_stored_segment(vectorstore, segment)
+
+
+def _merge_stored_segment(vectorstore, segment):
+    """Append a segment whose chunks are already in the chunk store."""
+    import faiss
+
+    if vectorstore is None:
+        return FAISS(
+            segment.embedding_function,
+            configure_index(faiss.clone_index(segment.index)),
+            ChunkStoreDocstore(get_chunk_store()),
+            dict(segment.index_to_docstore_id),
+        )
+    return append_stored_vectors(vectorstore, segment, copy_documents=False)
+
+
+def clone_vector_store(vectorstore):
+    """
+    Copy a vector store so a writer can modify it while readers keep using
+    the original. The FAISS index is copied in memory (no disk round trip);
+    the chunk store is shared, only the id mapping is copied.
+    """
+    import faiss
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+
+    docstore = vectorstore.docstore
+    if isinstance(docstore, InMemoryDocstore):
+        docstore = InMemoryDocstore(dict(docstore._dict))
+    return FAISS(
+        vectorstore.embedding_function,
+        configure_index(faiss.clone_index(vectorstore.index)),
+        docstore,
+        dict(vectorstore.index_to_docstore_id),
+    )
+
+
+def append_stored_vectors(vectorstore, source, start=0, copy_documents=True):
+    """
+    Append the entries of source from FAISS position start onwards to
+    vectorstore, reading the stored vectors back instead of re-embedding.
+    Unlike FAISS.merge_from this works whatever the index types are (a flat
+    segment into an HNSW or IVF base, for instance). Documents are copied
+    unless both share a docstore or copy_documents is False (already stored).
+    """
+    count = source.index.ntotal - start
+    if count <= 0:
+        return vectorstore
+    vectors = source.index.reconstruct_n(start, count)
+    offset = vectorstore.index.ntotal
+    vectorstore.index.add(vectors)
+    doc_ids = [source.index_to_docstore_id[position] for position in range(start, start + count)]
+    if copy_documents and source.docstore is not vectorstore.docstore:
+        vectorstore.docstore.add({doc_id: source.docstore.search(doc_id) for doc_id in doc_ids})
+    for i, doc_id in enumerate(doc_ids):
+        vectorstore.index_to_docstore_id[offset + i] = doc_id
+    return vectorstore
+
+
+def rebuild_vector_store(vectorstore, kind=None):
+    """
+    Return a copy of the vector store re-indexed as the given index kind
+    ("flat", "ivf" or "hnsw"; by default whatever the index policy wants for
+    its size). Stored vectors are read back, so nothing is re-embedded.
+    Returns (vector_store, vectors) so the caller can evaluate the new index.
+    """
+    index = vectorstore.index
+    kind = kind or target_kind(index.ntotal, index_kind(index))
+    vectors = index.reconstruct_n(0, index.ntotal)
+    rebuilt = FAISS(
+        vectorstore.embedding_function,
+        build_index(vectors, kind),
+        vectorstore.docstore,
+        dict(vectorstore.index_to_docstore_id),
+    )
+    return rebuilt, vectors
+
+
+def compact_vector_store(vectorstore, force=False):
+    """
+    Merge all segments into a fresh base by saving the live vector store.
+    The caller's in-memory store must already contain every segment, so it
+    must hold index_lock and have loaded the current index_generation().
+    force=True rewrites the base even without new segments (after deletions).
+    """
+    state = _read_state()
+    segments = _list_segments(state["compacted_through"])
+    through = max([_segment_number(n) for n in segments] + [state["compacted_through"]])
+    base = f"base-{through:06d}"
+    if base == state["base"] or (state["base"] or "").startswith(base + "-"):
+        if not force:
+            return False
+        base = f"{base}-{uuid.uuid4().hex[:8]}"
+
+    tmp_path = os.path.join(INDEX_PATH, f".tmp-{base}")
+    _write_index_dir(tmp_path, base, vectorstore)
+    os.replace(tmp_path, os.path.join(INDEX_PATH, base))
+    _write_state({"base": base, "compacted_through": through})
+    # The previous base's positions are kept one more generation for
+    # read-only workers that haven't switched to the new base yet
+    get_chunk_store().drop_positions([base, state["base"] or base])
+
+    # Everything below is cleanup; the new state is already durable.
+    old_base = state["base"]
+    if old_base == ".":
+        for name in ("index.faiss", "index.pkl"):
+            path = os.path.join(INDEX_PATH, name)
+            if os.path.exists(path):
+                os.remove(path)
+    elif old_base:
+        shutil.rmtree(os.path.join(INDEX_PATH, old_base), ignore_errors=True)
+    for name in os.listdir(SEGMENTS_DIR) if os.path.exists(SEGMENTS_DIR) else []:
+        if name.startswith("seg-") and _segment_number(name) <= through:
+            shutil.rmtree(os.path.join(SEGMENTS_DIR, name), ignore_errors=True)
+    return True
+
+
+def remove_from_vector_store(vectorstore, doc_ids):
+    """
+    Remove documents by docstore id: their vectors are dropped from the FAISS
+    index and the position -> id map renumbered. No re-embedding is involved.
+    Chunk rows stay in the chunk store, since readers of the previous index
+    version may still fetch them; the caller deletes them once the new
+    version is published.
+    """
+    import faiss
+
+    if not doc_ids:
+        return vectorstore
+    doc_ids = set(doc_ids)
+    ids = vectorstore.index_to_docstore_id
+    kept = [pos for pos in sorted(ids) if ids[pos] not in doc_ids]
+    removed = np.array([pos for pos in sorted(ids) if ids[pos] in doc_ids], dtype=np.int64)
+
+    if isinstance(faiss.downcast_index(vectorstore.index), faiss.IndexFlatCodes):
+        # Flat indexes shift later vectors down, matching the renumbering below
+        vectorstore.index.remove_ids(removed)
     else:
-        vectorstore = FAISS.from_documents(chunks, embeddings)
-        
-    vectorstore.save_local(INDEX_PATH)
+        # HNSW can't remove vectors and IVF keeps gaps in its ids, so approximate
+        # indexes are refilled with the kept vectors (training is kept)
+        vectors = vectorstore.index.reconstruct_batch(np.array(kept, dtype=np.int64)) if kept else None
+        index = faiss.clone_index(vectorstore.index)
+        index.reset()
+        configure_index(index)
+        if kept:
+            index.add(vectors)
+        vectorstore.index = index
+    vectorstore.index_to_docstore_id = {new_pos: ids[old_pos] for new_pos, old_pos in enumerate(kept)}
     return vectorstore
 
-def load_vector_store(embeddings):
+
+def rank_positions(vectorstore, query_embedding, k, positions=None):
+    """
+    FAISS positions of the k stored vectors nearest to the query, with their
+    L2 distances, optionally restricted to the given positions.
+    Returns (positions, distances) arrays, nearest first.
+    """
+    return rank_positions_many(vectorstore, [query_embedding], k, positions)[0]
+
+
+def rank_positions_many(vectorstore, query_embeddings, k, positions=None):
+    """
+    rank_positions for several queries restricted to the same positions,
+    with one multi-row search. On a flat float32 index the restriction runs
+    inside FAISS through an ID selector, so only the selected vectors are
+    scored. Approximate indexes could miss selected vectors outside the
+    probed lists / graph neighbourhood, so for those (and compressed ones)
+    the selected vectors are read back once and scored directly.
+    Returns one (positions, distances) pair per query, nearest first.
+    """
+    import faiss
+
+    queries = np.ascontiguousarray(query_embeddings, dtype=np.float32)
+    if positions is None:
+        return search_many(vectorstore, queries, k)
+
+    positions = np.asarray(positions, dtype=np.int64)
+    if len(positions) == 0:
+        return [(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)) for _ in queries]
+    k = min(k, len(positions))
+    if type(faiss.downcast_index(vectorstore.index)) in (faiss.IndexFlat, faiss.IndexFlatL2):
+        selector = faiss.IDSelectorBatch(positions)
+        params = faiss.SearchParameters(sel=selector)
+        distances, indices = vectorstore.index.search(queries, k, params=params)
+    else:
+        vectors = vectorstore.index.reconstruct_batch(positions)
+        distances, indices = [], []
+        for query in queries:
+            all_distances = ((vectors - query) ** 2).sum(axis=1)
+            order = np.argsort(all_distances)[:k]
+            distances.append(all_distances[order])
+            indices.append(positions[order])
+    results = []
+    for row_distances, row_indices in zip(distances, indices):
+        found = row_indices != -1
+        results.append((row_indices[found], row_distances[found]))
+    return results
+
+
+def search_many(vectorstore, query_embeddings, k):
+    """
+    Nearest stored vectors for several queries with one multi-row FAISS
+    search. Returns one (positions, distances) pair per query, nearest first.
+    """
+    queries = np.ascontiguousarray(query_embeddings, dtype=np.float32)
+    distances, indices = vectorstore.index.search(queries, min(k, vectorstore.index.ntotal))
+    results = []
+    for row_distances, row_indices in zip(distances, indices):
+        found = row_indices != -1
+        results.append((row_indices[found], row_distances[found]))
+    return results
+
+
+def current_base():
+    """Name of the compacted base the on-disk index currently points to."""
+    return _read_state()["base"]
+
+
+def load_vector_store(embeddings, read_only=False):
     """
     Load the existing vector store.
+    With read_only=True, return a memory-mapped view of the compacted base
+    (see _load_serving_store).
     """
     if not os.path.exists(INDEX_PATH):
         return None
-        
-    return FAISS.load_local(INDEX_PATH, embeddings, allow_dangerous_deserialization=True)
 
-def clear_vector_store():
+    state = _read_state()
+    store = get_chunk_store(read_only=read_only)
+    if read_only and state["base"] and store.has_positions(state["base"]):
+        return _load_serving_store(embeddings, state, store)
+    if read_only:
+        print("The current index hasn't been moved to the chunk store yet; loading it into memory.")
+
+    vectorstore = None
+    if state["base"]:
+        vectorstore = _read_index_dir(
+            os.path.join(INDEX_PATH, state["base"]), state["base"], embeddings, store, migrate=not read_only
+        )
+
+    for name in _list_segments(state["compacted_through"]):
+        segment = _read_index_dir(os.path.join(SEGMENTS_DIR, name), name, embeddings, store, migrate=not read_only)
+        if vectorstore is None:
+            vectorstore = segment
+        else:
+            append_stored_vectors(vectorstore, segment)
+
+    return vectorstore
+
+
+def _load_serving_store(embeddings, state, store):
     """
-    Delete the vector store index to start fresh.
+    Read-only view of the last compacted base for serving workers. The FAISS
+    index is memory-mapped, so its pages live in the OS page cache and are
+    shared by every worker instead of being copied into each heap; chunk ids
+    and text are read from the chunk store only for the results a search
+    returns. Segments added since the last compaction are not served until
+    the writer compacts them (RAG_COMPACTION_SEGMENTS = 1 on the writer makes
+    every upload visible right away).
     """
-    import shutil
-    if os.path.exists(INDEX_PATH):
-        shutil.rmtree(INDEX_PATH)
-        return True
-    return False
+    import faiss
+
+    flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+    index = configure_index(faiss.read_index(os.path.join(INDEX_PATH, state["base"], "index.faiss"), flags))
+    pending = _list_segments(state["compacted_through"])
+    if pending:
+        print(f"Serving {state['base']}; {len(pending)} newer segment(s) are not served until compaction.")
+    return FAISS(embeddings, index, ChunkStoreDocstore(store), ChunkIdMap(store, state["base"]))
+
+
+def clear_vector_store(keep_chunks=False):
+    """
+    Delete the index files to start fresh: bases, segments, index_state.json
+    and, unless keep_chunks, the chunk store. Everything else in rag_index is
+    kept: stored uploads (queued jobs still need them), reports, the lock
+    file and the temp files of uploads being embedded.
+    With keep_chunks the chunk rows stay but no longer belong to any index.
+    """
+    if not os.path.exists(INDEX_PATH):
+        return False
+    for name in os.listdir(INDEX_PATH):
+        path = os.path.join(INDEX_PATH, name)
+        if name.startswith(("base-", ".tmp-base-")):
+            shutil.rmtree(path, ignore_errors=True)
+        elif name in ("index.faiss", "index.pkl", "source_index.json", os.path.basename(STATE_FILE)):
+            # index.pkl and source_index.json: written by earlier versions
+            os.remove(path)
+        elif name.startswith(os.path.basename(CHUNK_STORE_PATH)) and not keep_chunks:
+            os.remove(path)
+    for name in os.listdir(SEGMENTS_DIR) if os.path.exists(SEGMENTS_DIR) else []:
+        if name.startswith(("seg-", ".tmp-seg-")):
+            shutil.rmtree(os.path.join(SEGMENTS_DIR, name), ignore_errors=True)
+    if keep_chunks:
+        get_chunk_store().drop_positions([])
+    return True
@@ -249,8 +249,10 @@ async function handleDocumentUpload(input) {
     }
 
     let originalIcon = '';
+    let originalTitle = '';
     if (btn) {
         originalIcon = btn.innerHTML;
+        originalTitle = btn.title;
         btn.innerHTML = '<i class="fas fa-spinner fa-spin"></i>';
         btn.disabled = true;
     }
@@ -263,9 +265,19 @@ async function handleDocumentUpload(input) {
         });
 
         console.log("Upload status:", response.status);
-        const data = await response.json();
+        let data = await response.json();
         console.log("Upload response:", data);
 
+        // Ingestion runs in the background; poll until the job finishes
+        if (data.status === 'queued') {
+            const job = await pollIngestJob(data.job_id, (progress) => {
+                if (btn && progress.pages_total) {
+                    btn.title = `Processed ${progress.pages_parsed}/${progress.pages_total} pages (${progress.chunks_embedded} chunks)...`;
+                }
+            });
+            data = { ...job, error: job.status === 'error' ? job.message : undefined };
+        }
+
         if (data.status === 'success') {
             const successMsg = `Document uploaded successfully: ${data.message}`;
             console.log(successMsg);
@@ -284,12 +296,29 @@ async function handleDocumentUpload(input) {
     } finally {
         if (btn) {
             btn.innerHTML = originalIcon;
+            btn.title = originalTitle;
             btn.disabled = false;
         }
         input.value = '';
     }
 }
 
+async function pollIngestJob(jobId, onProgress, intervalMs = 1000) {
+    // Poll a background ingestion job until it succeeds or fails
+    while (true) {
+        const response = await fetch(`/api/ingest_jobs/${jobId}`);
+        const job = await response.json();
+        if (!response.ok) {
+            return { status: 'error', message: job.error || 'Ingestion job not found' };
+        }
+        if (onProgress) onProgress(job);
+        if (job.status === 'success' || job.status === 'error') {
+            return job;
+        }
+        await new Promise((resolve) => setTimeout(resolve, intervalMs));
+    }
+}
+
 async function clearKnowledgeBase() {
     if (!confirm('This will remove all uploaded documents from the knowledge base. Continue?')) {
         return;
@@ -6,7 +6,9 @@ from database import TutorialDatabase
 
 # Import the existing API configuration
 from LLM_api import client
-from rag_engine import RAGEngine
+from rag_engine import get_rag_engine
+from prompt_packer import pack_prompt
+from config import MAX_CONTEXT_MESSAGES
 
 class TutorialState(TypedDict):
     """State object for the tutorial agent."""
@@ -18,13 +20,14 @@ class TutorialState(TypedDict):
     user_understanding: Dict[str, Any]
     language: str
     retrieved_context: str # Added for RAG
+    retrieved_chunks: List[str] # Ranked RAG chunks, packed into the prompt budget
 
 class TutorialAgent:
     """LangGraph-based AI tutorial agent."""
     
     def __init__(self):
         self.db = TutorialDatabase()
-        self.rag_engine = RAGEngine()
+        self.rag_engine = get_rag_engine()
         self.graph = self._create_graph()
     
     def _create_graph(self) -> StateGraph:
@@ -148,12 +151,12 @@ Remember: Students are here to LEARN. Give them knowledge to work with!"""
         last_message = state["messages"][-1]
         query = last_message.content
         
-        # Use RAG engine facade to get formatted context
-        # Note: We are using the facade's helper which returns a string "CONTEXT FROM..."
-        # We store this in the state.
-        context = self.rag_engine.get_formatted_context(query)
+        # Keep the ranked chunks so prompts can pack as many as fit their
+        # token budget; the formatted string is kept for callers that want it
+        chunks = self.rag_engine.get_context_chunks(query)
+        context = self.rag_engine.format_context(chunks)
         
-        return {"retrieved_context": context}
+        return {"retrieved_context": context, "retrieved_chunks": chunks}
     
     def _handle_question(self, state: TutorialState) -> TutorialState:
         """Handle user questions about the tutorial content."""
@@ -162,15 +165,18 @@ Remember: Students are here to LEARN. Give them knowledge to work with!"""
         language = state.get("language", "English")
         
         # Get conversation context
-        context_messages = state["messages"][-5:]  # Last 5 messages for context
-        context = "\n".join([f"{msg.__class__.__name__[:-7]}: {msg.content}" for msg in context_messages])
+        context_messages = state["messages"][-MAX_CONTEXT_MESSAGES:]
+        turns = [f"{msg.__class__.__name__[:-7]}: {msg.content}" for msg in context_messages]
         
-        context = "\n".join([f"{msg.__class__.__name__[:-7]}: {msg.content}" for msg in context_messages])
+        # Get RAG chunks from state (populated by _retrieve_knowledge node)
+        rag_chunks = state.get("retrieved_chunks", [])
         
-        # Get RAG context from state (populated by _retrieve_knowledge node)
-        rag_context = state.get("retrieved_context", "")
-        
-        prompt = f"""You are Socrates, an AI tutor who teaches about {subject}.
+        # Instructions first, then the latest turns, then the best chunks,
+        # within the prompt token budget
+        def build_prompt(turns, chunks):
+            context = "\n".join(turns)
+            rag_context = self.rag_engine.format_context(chunks)
+            return f"""You are Socrates, an AI tutor who teaches about {subject}.
 
 IMPORTANT: Write your response in {language}.
 
@@ -207,6 +213,7 @@ Student's message: "{user_question}"
 IMPORTANT: You must TEACH! Provide real knowledge and explanations.
 If there is relevant context from uploaded documents, use it in your response."""
 
+        prompt = pack_prompt(build_prompt, turns, rag_chunks)
         response = self._call_llm(prompt)
         
         # Save to database
@@ -236,16 +243,16 @@ If there is relevant context from uploaded documents, use it in your response.""
         subject = state["subject"]
         evaluation_count = state.get("evaluation_count", 0)
         
-        # Get tutorial content for context
-        tutorial_content = ""
-        for msg in state["messages"]:
-            if isinstance(msg, AIMessage):
-                tutorial_content += msg.content + "\n"
+        # Get tutorial content for context; the latest turns are kept when
+        # it doesn't all fit the prompt token budget
+        tutorial_turns = [msg.content for msg in state["messages"] if isinstance(msg, AIMessage)]
         
-        prompt = f"""You are an expert AI tutor. Based on the tutorial content about {subject}, create a thoughtful evaluation question.
+        def build_prompt(turns, chunks):
+            tutorial_content = "\n".join(turns)
+            return f"""You are an expert AI tutor. Based on the tutorial content about {subject}, create a thoughtful evaluation question.
 
 Tutorial content covered:
-{tutorial_content[:1000]}...
+{tutorial_content}
 
 Create ONE evaluation question that:
 1. Tests understanding of key concepts
@@ -258,6 +265,7 @@ QUESTION: [Your question here]
 
 This is evaluation question #{evaluation_count + 1}."""
 
+        prompt = pack_prompt(build_prompt, tutorial_turns)
         response = self._call_llm(prompt)
         
         # Save to database